@@ -0,0 +1,301 @@
+"""Dead store elimination for Bril programs that use the memory extension.
+
+This is the Bril counterpart of the DeadStoreElim.cpp pass. The function
+is put in SSA form and its memory accesses are linked into MemorySSA:
+all of memory is one variable, every `store`, `free` and `call` defines
+a new version of it, every `load`, `call` and `ret` uses the current
+version, and a phi merges the versions where control flow joins. The
+users of each definition then say where its memory goes next.
+
+A store is dead if no read can see what it wrote: following the chain
+of users from the store, every path either meets a store that writes
+exactly the same address (or a `free` of the same allocation) or leaves
+the function without reading it. Leaving only counts as a read if the
+memory may escape, i.e. it did not come from a local `alloc` or the
+pointer was passed to a call, returned or stored to memory.
+
+Aliasing comes from the allocation sites: each pointer may point into
+the allocations it was derived from, or anywhere when it is a parameter,
+was loaded from memory or returned by a call. Two pointers are the same
+address when they are the same SSA value, plus the same constant
+`ptradd` offset, and that value cannot change in between (it is not
+defined on a loop around the store).
+
+    bril2json < prog.bril | python3 dse.py | bril2txt
+"""
+
+import json
+import os
+import sys
+
+# the SSA and CFG helpers live with the worklist assignment
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Assignment-WorklistAlgorithm"))
+import cfg
+import ssa
+
+# Points-to target of pointers that may point anywhere.
+UNKNOWN = "?"
+
+DEFS = {"store", "free", "call"}
+USES = {"load", "ret"}
+
+
+class MemoryAccess:
+    """A node of MemorySSA. `kind` is "def", "use" or "phi"; `defining`
+    is the access whose version of memory it reads (None for the phis,
+    which have `incoming` instead) and `users` the accesses that read
+    the version it defines.
+    """
+
+    __slots__ = ("kind", "instr", "block", "defining", "incoming", "users")
+
+    def __init__(self, kind, instr, block):
+        self.kind = kind
+        self.instr = instr
+        self.block = block
+        self.defining = None
+        self.incoming = []
+        self.users = []
+
+
+def is_pointer(typ):
+    return isinstance(typ, dict) and "ptr" in typ
+
+
+def memory_ssa(blocks, idom, children):
+    """Build MemorySSA for an SSA block map. Returns the access of every
+    memory instruction (by id) in block order, and the phis per block.
+    """
+    entry = next(iter(blocks))
+    accesses = {}
+    def_blocks = set()
+    for name, block in blocks.items():
+        for instr in block:
+            op = instr.get("op")
+            if op in DEFS:
+                accesses[id(instr)] = MemoryAccess("def", instr, name)
+                def_blocks.add(name)
+            elif op in USES:
+                accesses[id(instr)] = MemoryAccess("use", instr, name)
+
+    # Phis at the iterated dominance frontier of the defining blocks.
+    frontiers = ssa.dominance_frontiers(blocks, idom)
+    phis = {}
+    work = list(def_blocks)
+    while work:
+        for join in frontiers[work.pop()]:
+            if join not in phis:
+                phis[join] = MemoryAccess("phi", None, join)
+                work.append(join)
+
+    # Rename along the dominator tree, starting from the memory the
+    # function is called with.
+    live_on_entry = MemoryAccess("def", None, entry)
+    stack = [(entry, live_on_entry)]
+    while stack:
+        name, current = stack.pop()
+        if name in phis:
+            current = phis[name]
+        for instr in blocks[name]:
+            access = accesses.get(id(instr))
+            if access is None:
+                continue
+            access.defining = current
+            current.users.append(access)
+            if access.kind == "def":
+                current = access
+        for succ in dict.fromkeys(cfg.successors(blocks[name][-1])):
+            if succ in phis:
+                phis[succ].incoming.append((name, current))
+                current.users.append(phis[succ])
+        stack += [(child, current) for child in reversed(children[name])]
+    return accesses, phis
+
+
+class PointerInfo:
+    """Where each pointer of an SSA function may point, and which exact
+    address it is when that is known.
+    """
+
+    def __init__(self, blocks, params):
+        self.defs = {}
+        self.owner = {}
+        types = {}
+        for name, block in blocks.items():
+            for instr in block:
+                if "dest" in instr:
+                    self.defs[instr["dest"]] = instr
+                    self.owner[instr["dest"]] = name
+                    types[instr["dest"]] = instr.get("type")
+
+        self.points_to = {arg["name"]: {UNKNOWN} for arg in params if is_pointer(arg["type"])}
+        # Allocation sites whose address leaves the function's hands.
+        self.escaped = set()
+        pointers = {var for var, typ in types.items() if is_pointer(typ)}
+        changed = True
+        while changed:
+            changed = False
+            for var in pointers:
+                instr = self.defs[var]
+                op = instr.get("op")
+                if op == "alloc":
+                    sites = {var}
+                elif op in ("id", "ptradd", "phi"):
+                    sites = set()
+                    for arg in instr["args"][:1] if op == "ptradd" else instr["args"]:
+                        sites |= self.points_to.get(arg, set())
+                else:  # load, call
+                    sites = {UNKNOWN}
+                if not sites <= self.points_to.get(var, set()):
+                    self.points_to[var] = self.points_to.get(var, set()) | sites
+                    changed = True
+
+        for block in blocks.values():
+            for instr in block:
+                op = instr.get("op")
+                if op == "store":
+                    leaked = instr["args"][1:]
+                elif op in ("call", "ret"):
+                    leaked = instr.get("args", [])
+                else:
+                    continue
+                for arg in leaked:
+                    self.escaped |= self.points_to.get(arg, set())
+        self.escaped.discard(UNKNOWN)
+
+    def sites(self, ptr):
+        sites = self.points_to.get(ptr, set())
+        if UNKNOWN in sites or sites & self.escaped:
+            return sites | self.escaped | {UNKNOWN}
+        return sites
+
+    def address(self, ptr):
+        """(root, offset): `ptr` is `offset` elements past the SSA value
+        `root`; the offset is None when it is not a constant.
+        """
+        instr = self.defs.get(ptr)
+        op = instr and instr.get("op")
+        if op == "id":
+            return self.address(instr["args"][0])
+        if op == "ptradd":
+            root, offset = self.address(instr["args"][0])
+            step = self.defs.get(instr["args"][1])
+            if offset is not None and step is not None and step.get("op") == "const":
+                return root, offset + step["value"]
+            return root, None
+        return ptr, 0
+
+    def may_alias(self, p, q, same_roots=True):
+        """Whether `p` and `q` may point to the same element. With
+        `same_roots` false, a value may have changed between the two
+        accesses, so equal SSA names say nothing.
+        """
+        (p_root, p_offset), (q_root, q_offset) = self.address(p), self.address(q)
+        if same_roots and p_root == q_root and p_offset is not None and q_offset is not None:
+            return p_offset == q_offset
+        return not self.sites(p).isdisjoint(self.sites(q))
+
+    def escapes(self, ptr):
+        return not self.sites(ptr).isdisjoint(self.escaped | {UNKNOWN})
+
+
+def dead_stores(blocks, params):
+    """The stores of an SSA block map that no load can observe."""
+    idom, children = ssa.dominator_tree(blocks)
+    accesses, _ = memory_ssa(blocks, idom, children)
+    pointers = PointerInfo(blocks, params)
+    succs = cfg.edges(blocks)[1]
+    reach = {}
+
+    def reachable(start):
+        """The blocks reachable from `start` by at least one edge."""
+        if start not in reach:
+            seen = set()
+            work = list(succs[start])
+            while work:
+                name = work.pop()
+                if name not in seen:
+                    seen.add(name)
+                    work += succs[name]
+            reach[start] = seen
+        return reach[start]
+
+    def stable(root, block):
+        """Whether `root` keeps its value from a store in `block` on:
+        it is a parameter, or defined where `block` cannot get back to.
+        """
+        owner = pointers.owner.get(root)
+        return owner is None or owner not in reachable(block)
+
+    def overwrites(access, store):
+        """Whether `access` writes all that `store` wrote."""
+        instr = access.instr
+        ptr = store.instr["args"][0]
+        root, offset = pointers.address(ptr)
+        if instr["op"] == "store":
+            return (offset is not None and pointers.address(instr["args"][0]) == (root, offset)
+                    and stable(root, store.block))
+        if instr["op"] == "free":
+            return pointers.address(instr["args"][0])[0] == root and stable(root, store.block)
+        return False
+
+    def observed(store):
+        ptr = store.instr["args"][0]
+        same_roots = stable(pointers.address(ptr)[0], store.block)
+        work = list(store.users)
+        seen = set()
+        while work:
+            access = work.pop()
+            if id(access) in seen:
+                continue
+            seen.add(id(access))
+            if access.kind == "phi":
+                work += access.users
+                continue
+            op = access.instr["op"]
+            if op == "load" and pointers.may_alias(access.instr["args"][0], ptr, same_roots):
+                return True
+            if op in ("ret", "call") and pointers.escapes(ptr):
+                return True
+            if access.kind == "def" and not overwrites(access, store):
+                work += access.users
+        return False
+
+    return [access.instr for access in accesses.values()
+            if access.instr["op"] == "store" and not observed(access)]
+
+
+def optimize(func):
+    """Return the instructions of a function without its dead stores."""
+    blocks = optimize_blocks(func)
+    if not blocks:
+        return list(func["instrs"])
+    return cfg.reassemble(blocks, elide_jumps=True)
+
+
+def optimize_blocks(func, blocks=None):
+    """Delete the dead stores of a function and return its block map.
+    The function's `blocks`, if given, are changed in place (see
+    `ssa.to_ssa`).
+    """
+    blocks, origins = ssa.to_ssa(func, blocks)
+    if not blocks:
+        return blocks
+    dead = set()
+    for instr in dead_stores(blocks, func.get("args", [])):
+        dead.add(id(instr))
+        print("Dead store deleted: ", dict(instr, args=[origins.get(arg, arg) for arg in instr["args"]]),
+              file=sys.stderr)
+    for block in blocks.values():
+        block[:] = [instr for instr in block if id(instr) not in dead]
+    # Deleting stores defines no variable, so the function is still in
+    # conventional SSA and can go back to its original names.
+    ssa.from_ssa(blocks, origins)
+    return blocks
+
+
+if __name__ == "__main__":
+    prog = json.load(sys.stdin)
+    for func in prog["functions"]:
+        func["instrs"] = optimize(func)
+    print(json.dumps(prog, indent=2))
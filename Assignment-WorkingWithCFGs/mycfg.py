@@ -8,9 +8,21 @@ Assignment: Working with CFGs
 """
 
 import json
+import os
 import sys
 import getopt
-from collections import deque # for queue implementation
+import functools
+from array import array
+from collections import deque, namedtuple # for queue implementation
+
+# shared Bril helpers (streaming reader, ...) live with the worklist assignment
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Assignment-WorklistAlgorithm'))
+import brilbin # reads JSON or the binary format
+import parallel
+import cache # content-addressed cache of per-function reports
+from cfg import CFG, immediate_dominator_ids # compact integer-indexed graph shared with the worklist cfg module
+from reach import batched_path_lengths # multi-source BFS over bitsets
+from instr import Instr # compact instructions, which read like the JSON dicts
 
 TERMS = 'jmp', 'br', 'ret' # terminators used to indicate a change of control flow
 
@@ -39,7 +51,7 @@ def block_map(blocks):
         if not block:
             continue
         first = block[0]
-        if isinstance(first, dict) and 'label' in first:
+        if isinstance(first, (dict, Instr)) and 'label' in first:
             name = first['label']
         else:
             name = 'b{}'.format(len(out))
@@ -48,89 +60,137 @@ def block_map(blocks):
         
     return out
 
-# The function cfg_alg takes the block_map and creates a cfg   
+# The function cfg_alg takes the block_map and creates a cfg. The cfg is a CFG: every block
+# gets a dense integer ID and the edges are stored in flat arrays, but it still reads like a
+# dict from each block name to the list of its successors' names. Built in linear time
 def cfg_alg(nameblock_map):
-    cfg = {}
     names = list(nameblock_map.keys())
-    for name, block in nameblock_map.items():
-        last = block[-1]
-        if last['op'] == 'jmp':
-            cfg[name] = last['labels']
-        elif last['op'] == 'br':
-            cfg[name] = [last['labels'][0], last['labels'][1]]
-        else:
-            index = names.index(name)
-            if index + 1 < len(names):
-                next_block = names[index+1]
-                cfg[name] = [next_block]
+    
+    def successor_lists():
+        for index, block in enumerate(nameblock_map.values()):
+            last = block[-1]
+            op = last.get('op') # a block can be a lone label, which falls through
+            if op == 'jmp':
+                yield last['labels']
+            elif op == 'br':
+                yield [last['labels'][0], last['labels'][1]]
+            elif index + 1 < len(names):
+                yield [names[index + 1]]
             else:
-                cfg[name] = [] 
+                yield []
                 
-    return cfg
+    return CFG(names, successor_lists())
+
+
+# The function as_graph lets every function below also take a plain dict of successor lists
+def as_graph(cfg):
+    if isinstance(cfg, CFG):
+        return cfg
+    return CFG.from_dict(cfg)
 
 
 ## FUNCTIONS for Working with CFGs assignment
 
-# The function get_path_lengths serves to return the lengths of each path it takes to go to each node from the given entry point
-def get_path_lengths(cfg, entry):
+# Everything a single traversal of the cfg from the entry computes:
+# - preorder / postorder: reachable nodes in DFS discovery / finishing order
+# - rpo: reverse postorder, and rpo_number: each node's position in it
+# - edges: (src, dest, kind) for every edge out of a reachable node, in DFS order, where kind
+#   is 'tree', 'back' (dest is a DFS ancestor of src), 'forward' or 'cross'
+# - lengths: shortest path length (in edges) from the entry, in BFS discovery order
+Traversal = namedtuple('Traversal', ['preorder', 'postorder', 'rpo', 'rpo_number', 'edges', 'lengths'])
+
+# The function traverse runs one iterative DFS and one BFS over the cfg and returns a Traversal.
+# It uses an explicit stack, so long chains and deep nesting don't hit the recursion limit.
+# Results are cached on the CFG, so each mode after the first is just a view.
+# With sort_successors the DFS visits successors in sorted order instead of cfg order
+def traverse(cfg, entry, sort_successors=False):
+    
+    cfg = as_graph(cfg)
+    key = (entry, sort_successors)
+    if key in cfg.traversals:
+        return cfg.traversals[key]
     
-    path_lengths = {}
-    visited = set()
-    q = deque()
+    names = cfg.names
+    offsets, targets = cfg.succ_offsets, cfg.succ_targets
     
-    q.append(entry)
-    visited.add(entry)
+    def successors_of(node):
+        succs = targets[offsets[node]:offsets[node + 1]]
+        return iter(sorted(succs, key=names.__getitem__) if sort_successors else succs)
     
-    path_lengths[entry] = 0
+    start = cfg.ids[entry]
+    pre_number = array('i', [-1]) * len(names)
+    finished = bytearray(len(names))
+    pre_number[start] = 0
+    preorder = [start]
+    postorder = []
+    edges = []
+    stack = [(start, successors_of(start))]
     
+    while stack:
+        node, successors = stack[-1]
+        for succ in successors:
+            if pre_number[succ] < 0:
+                edges.append((names[node], names[succ], 'tree'))
+                pre_number[succ] = len(preorder)
+                preorder.append(succ)
+                stack.append((succ, successors_of(succ)))
+                break
+            elif not finished[succ]:
+                edges.append((names[node], names[succ], 'back'))
+            elif pre_number[succ] > pre_number[node]:
+                edges.append((names[node], names[succ], 'forward'))
+            else:
+                edges.append((names[node], names[succ], 'cross'))
+        else:
+            stack.pop()
+            finished[node] = 1
+            postorder.append(node)
+    
+    rpo = [names[node] for node in reversed(postorder)]
+    rpo_number = {name: i for i, name in enumerate(rpo)}
+    
+    # breadth first search for the path lengths
+    distance = array('i', [-1]) * len(names)
+    distance[start] = 0
+    lengths = {entry: 0}
+    q = deque([start])
     while q:
         current_node = q.popleft()
-        successors = cfg[current_node]
-        for succ in successors:
-            if succ not in visited:
-                visited.add(succ)
+        for succ in targets[offsets[current_node]:offsets[current_node + 1]]:
+            if distance[succ] < 0:
+                distance[succ] = distance[current_node] + 1
+                lengths[names[succ]] = distance[succ]
                 q.append(succ)
-                path_lengths[succ] = path_lengths[current_node] + 1
-                
-    return path_lengths
+    
+    result = Traversal([names[node] for node in preorder], [names[node] for node in postorder],
+                       rpo, rpo_number, edges, lengths)
+    cfg.traversals[key] = result
+    return result
+
+# The function get_path_lengths serves to return the lengths of each path it takes to go to each node from the given entry point
+def get_path_lengths(cfg, entry):
+    
+    return dict(traverse(cfg, entry).lengths)
           
+# The function get_all_path_lengths returns the path lengths from every node (or from each of the given
+# sources) to each node it reaches. All sources share one bit-parallel BFS instead of running one each
+def get_all_path_lengths(cfg, sources=None):
+    
+    return dict(batched_path_lengths(as_graph(cfg), sources))
+
 # The function reverse_postorder returns a list of nodes in reverse post order
 def reverse_postorder(cfg, entry):
     
-    visited = set()
-    post_order = []
-    
-    def dfs_traversal(node):
-        visited.add(node)
-        successors = cfg[node]
-        for succ in successors: 
-            if succ not in visited:
-                dfs_traversal(succ)
-        post_order.append(node)
-    dfs_traversal(entry)
-    
-    return list(reversed(post_order))
+    return list(traverse(cfg, entry).rpo)
     
 
 
-#The function find_back_edges returns a list of edges where one vertex is the ancestor of a current vertex in the recursion tree
+#The function find_back_edges returns a list of edges where one vertex is the ancestor of a current vertex in the DFS tree
+#(successors are visited in sorted order)
 def find_back_edges(cfg, entry):
     
-    back_edges = []
-    visited = set ()
-    ancestors = set()
-    
-    def dfs_traversal(node):
-        visited.add(node)
-        ancestors.add(node)
-        successors = cfg[node]
-        for succ in sorted(successors): 
-            if succ not in visited:
-                dfs_traversal(succ)
-            elif succ in ancestors:
-                back_edges.append((node, succ))
-        ancestors.remove(node)
-    dfs_traversal(entry)
+    back_edges = [(src, dest) for src, dest, kind in traverse(cfg, entry, sort_successors=True).edges
+                  if kind == 'back']
     
     if len(back_edges) == 0:
         return 'There are no back edges found in this CFG.'
@@ -138,110 +198,166 @@ def find_back_edges(cfg, entry):
         return back_edges
     
         
-# The fuction is_reducible determines where a CFG is reducible or not  
-def is_reducible(cfg, entry):    
+# The function immediate_dominators maps every node reachable from the entry to its
+# immediate dominator (the entry maps to itself). It is the iterative algorithm of
+# Cooper, Harvey & Kennedy, which runs over the nodes in reverse postorder and
+# converges in a couple of passes on real CFGs
+def immediate_dominators(cfg, entry):
+    
+    cfg = as_graph(cfg)
+    order = [cfg.ids[name] for name in traverse(cfg, entry).rpo]
+    idom = immediate_dominator_ids(cfg, cfg.ids[entry], order)
+    
+    return {cfg.names[node]: cfg.names[idom[node]] for node in order}
 
-    reduced_cfg = {}    
-        
-    # remove self-edges
+
+# The function dominance_intervals numbers the dominator tree in preorder and postorder,
+# so that a dominates b exactly when pre[a] <= pre[b] and post[b] <= post[a]
+def dominance_intervals(idom, entry):
+    
+    children = {node: [] for node in idom}
+    for node, parent in idom.items():
+        if node != entry:
+            children[parent].append(node)
+    
+    pre, post = {}, {}
+    counter = 0
+    stack = [(entry, False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            post[node] = counter
+        else:
+            pre[node] = counter
+            stack.append((node, True))
+            stack.extend((child, False) for child in children[node])
+        counter += 1
+    
+    return pre, post
+
+
+# The function find_irreducible_edges returns the edges that keep a CFG from being reducible:
+# retreating edges whose target does not dominate their source, plus the edges leaving nodes
+# that cannot be reached from the entry (those can never be collapsed into it).
+# The list is empty when the CFG is reducible (unless it has unreachable nodes without edges)
+def find_irreducible_edges(cfg, entry):
+    
+    cfg = as_graph(cfg)
+    idom = immediate_dominators(cfg, entry)
+    pre, post = dominance_intervals(idom, entry)
+    
+    offending = [(src, dest) for src, dest, kind in traverse(cfg, entry).edges
+                 if kind == 'back' and not (pre[dest] <= pre[src] and post[src] <= post[dest])]
+    
     for node in cfg:
-        reduced_successors = [succ for succ in cfg[node] if succ != node]
-        reduced_cfg[node] = reduced_successors
-        
-    # merge with predecessor
-    def compute_predecessors(cfg):
-        predecessors = {node: set() for node in cfg}
-        
-        for src in cfg:
-            for dest in cfg[src]:
-                predecessors[dest].add(src)
-                
-        return predecessors
+        if node not in idom:
+            offending.extend((node, succ) for succ in cfg[node])
     
-    predecessors = compute_predecessors(reduced_cfg)
+    return offending
     
-    # reduce
+        
+# The fuction is_reducible determines where a CFG is reducible or not: every node must be
+# reachable from the entry and every retreating edge must point to a dominator of its source
+def is_reducible(cfg, entry):    
+
+    cfg = as_graph(cfg)
+    if find_irreducible_edges(cfg, entry):
+        return False
     
-    while True:
-        modification = False 
-        for node in list(reduced_cfg):
-            if node == entry:
-                continue 
-            node_predeccesors = list(predecessors[node])
-            if len(node_predeccesors) == 1:
-                pred = node_predeccesors[0]
-                
-                # merge node successors into predeccessors successors
+    # unreachable nodes without any edges still can't be reduced into the entry
+    return len(traverse(cfg, entry).rpo) == len(cfg)
                 
-                for succ in reduced_cfg[node]:
-                    if succ != pred and succ not in reduced_cfg[pred]:
-                        reduced_cfg[pred].append(succ)
-                        predecessors[succ].add(pred)
-                    predecessors[succ].discard(node)
-                    
-                del reduced_cfg[node]
-                del predecessors[node]
                 
-                if node in reduced_cfg[pred]:
-                    reduced_cfg[pred].remove(node)
                 
-                modification = True
-                break
-            
-        if not modification:
-            break
-        
-    return len(reduced_cfg) == 1 and entry in reduced_cfg
+# The function build_cfg forms the blocks and the cfg of one function
+def build_cfg(func):
+    name_to_block = block_map(basic_block_alg(func['instrs']))
+    return name_to_block, cfg_alg(name_to_block)
+
+# The function cfg_report runs one mode over one function and returns what it prints.
+# A graph from build_cfg can be passed in to reuse it (and the traversals cached on it)
+def cfg_report(func, mode, graph=None):
+    name_to_block, cfg = graph or build_cfg(func)
+    
+    entry = list(name_to_block.keys())[0] # pulling the first block
+    
+    lines = []
+    if mode == "-c":
+        lines.append('digraph {} {{'.format(func['name']))
+        for name in name_to_block:
+            lines.append('  {};'.format(name))
+        for name, succs in cfg.items():
+            for succ in succs:
+                lines.append('  {} -> {};'.format(name,succ))
+        lines.append('}')
+    elif mode == "-l":
+        lengths = get_path_lengths(cfg, entry)
+        lines.append(json.dumps(lengths, indent=2))
+    elif mode == "-L":
+        lengths = get_all_path_lengths(cfg)
+        lines.append(json.dumps(lengths, indent=2))
+    elif mode == "-p":
+        order = reverse_postorder(cfg, entry)
+        lines.append("This is the reverse order:  {}".format(order))
+    elif mode == "-b":
+        back_edges = find_back_edges(cfg, entry)
+        if back_edges:
+            lines.append(str(back_edges))
+        else:
+            lines.append("No back edges were found in the given CFG.")
+    elif mode == "-r":
+        reducible = is_reducible(cfg, entry)
+        if reducible:
+            lines.append("Reducible")
+        else:
+            lines.append("Not reducible")
+    else:
+        lines.append("Invalid mode. Use -c, -l, -L, -p, -b, or -r.")
+    
+    return ''.join(line + '\n' for line in lines)
                 
                 
                 
 def mycfg():
     
+    usage = "Usage: python3 mycfg.py [-c|-l|-L|-p|-b|-r] [--stream] [--jobs N] [--cache DIR] [--compact]"
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "clpbr")
+        opts, args = getopt.getopt(sys.argv[1:], "clLpbr", ["stream", "jobs=", "cache=", "compact"])
     except getopt.GetoptError as err:
         print(err)
-        print("Usage: python3 mycfg.py [-c|-l|-p|-b|-r]")
+        print(usage)
         sys.exit(1)
         
-    mode = opts[0][0]
-    
-    prog = json.load(sys.stdin)
+    modes = [opt for opt, _ in opts if opt in ("-c", "-l", "-L", "-p", "-b", "-r")]
+    if not modes:
+        print(usage)
+        sys.exit(1)
+    mode = modes[0]
+    stream = any(opt == "--stream" for opt, _ in opts)
+    compact = any(opt == "--compact" for opt, _ in opts) # Instr objects instead of JSON dicts
+    jobs = 1
+    cache_dir = None
+    for opt, val in opts:
+        if opt == "--jobs":
+            jobs = int(val)
+        elif opt == "--cache":
+            cache_dir = val
     
-    for func in prog['functions']:
-        name_to_block = block_map(basic_block_alg(func['instrs']))
-        cfg = cfg_alg(name_to_block)
-        
-        entry = list(name_to_block.keys())[0] # pulling the first block
-        
-        if mode == "-c":
-            print('digraph {} {{'.format(func['name']))
-            for name in name_to_block:
-                print('  {};'.format(name))
-            for name, succs in cfg.items():
-                for succ in succs:
-                    print ('  {} -> {};'.format(name,succ))
-            print('}')
-        elif mode == "-l":
-            lengths = get_path_lengths(cfg, entry)
-            print(json.dumps(lengths, indent=2))
-        elif mode == "-p":
-            order = reverse_postorder(cfg, entry)
-            print("This is the reverse order: ", order)
-        elif mode == "-b":
-            back_edges = find_back_edges(cfg, entry)
-            if back_edges:
-                print(back_edges)
-            else:
-                print("No back edges were found in the given CFG.")
-        elif mode == "-r":
-            reducible = is_reducible(cfg, entry)
-            if reducible:
-                print("Reducible")
-            else:
-                print("Not reducible")
-        else:
-            print("Invalid mode. Use -c, -l, -p, -b, or -r.")
+    # with jobs > 1, functions are spread over worker processes; the
+    # reports still come back (and print) in the original order
+    report = functools.partial(cfg_report, mode=mode)
+    if cache_dir:
+        # functions whose report is cached from an earlier run are skipped
+        report = cache.cached(report, cache_dir, "mycfg " + mode)
+    if stream:
+        # parse, analyze and print one function at a time
+        for text in parallel.map_functions(report, brilbin.iter_functions(sys.stdin, compact=compact), jobs):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+    else:
+        prog = brilbin.load_program(sys.stdin, compact=compact)
+        for text in parallel.map_functions(report, prog['functions'], jobs):
+            sys.stdout.write(text)
         
         
             
@@ -0,0 +1,110 @@
+"""Dense bit-vector sets for data flow facts.
+
+A `Domain` numbers every fact that can show up in one function (a
+definition, an expression, ...) exactly once. A `BitSet` holds a subset
+of a domain as a plain Python int, so union, intersection and
+difference are single big-integer operations instead of set
+operations over tuples.
+"""
+
+
+class Domain:
+    """A numbering of the facts of a data flow analysis."""
+
+    def __init__(self, facts=()):
+        self.facts = []
+        self.index = {}
+        for fact in facts:
+            self.add(fact)
+
+    def __len__(self):
+        return len(self.facts)
+
+    def add(self, fact):
+        """Number `fact` if it is new and return its bit."""
+        idx = self.index.get(fact)
+        if idx is None:
+            idx = len(self.facts)
+            self.index[fact] = idx
+            self.facts.append(fact)
+        return 1 << idx
+
+    def bit(self, fact):
+        """The bit for a fact that is already numbered."""
+        return 1 << self.index[fact]
+
+    def mask(self, facts):
+        """The bits for an iterable of numbered facts."""
+        bits = 0
+        for fact in facts:
+            bits |= 1 << self.index[fact]
+        return bits
+
+    def full_mask(self):
+        return (1 << len(self.facts)) - 1
+
+    def decode(self, bits):
+        """The facts whose bits are set in `bits`, as a Python set."""
+        out = set()
+        while bits:
+            low = bits & -bits
+            out.add(self.facts[low.bit_length() - 1])
+            bits ^= low
+        return out
+
+    def empty(self):
+        return BitSet(self, 0)
+
+    def full(self):
+        return BitSet(self, self.full_mask())
+
+
+class BitSet:
+    """An immutable set of facts from a `Domain`, stored as an int."""
+
+    __slots__ = ("domain", "bits")
+
+    def __init__(self, domain, bits):
+        self.domain = domain
+        self.bits = bits
+
+    def __eq__(self, other):
+        if isinstance(other, BitSet):
+            return self.bits == other.bits
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, BitSet):
+            return self.bits != other.bits
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+    def __iter__(self):
+        return iter(self.domain.decode(self.bits))
+
+    def __contains__(self, fact):
+        idx = self.domain.index.get(fact)
+        return idx is not None and (self.bits >> idx) & 1 == 1
+
+    def __or__(self, other):
+        return BitSet(self.domain, self.bits | other.bits)
+
+    def __and__(self, other):
+        return BitSet(self.domain, self.bits & other.bits)
+
+    def __sub__(self, other):
+        return BitSet(self.domain, self.bits & ~other.bits)
+
+    def to_set(self):
+        return self.domain.decode(self.bits)
+
+    def __repr__(self):
+        return "BitSet({!r})".format(self.to_set())
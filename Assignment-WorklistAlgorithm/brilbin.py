@@ -0,0 +1,420 @@
+"""A compact binary format for Bril programs.
+
+Parsing and printing JSON takes much of the time the tools spend on big
+programs. This format stores every string (variables, labels, opcodes,
+types) once, in a string table, and every instruction as a fixed-size
+record of string numbers, so nothing has to be tokenized. Files are
+read through `mmap`: opening one only reads the trailer, and each
+function (and each string it uses) is decoded when it is asked for.
+
+    python3 brilbin.py < prog.json > prog.brb       # JSON to binary
+    python3 brilbin.py -d < prog.brb > prog.json    # and back
+
+Layout, all little-endian:
+    MAGIC
+    for each function: its instruction records, then its operands
+        (u32 string numbers of all args, funcs and labels, in order)
+    string table: u32 count, count + 1 u32 offsets, UTF-8 bytes
+    function index: one INDEX record per function
+    TRAILER, ending in MAGIC again
+
+An instruction record holds the instruction's key order, its op, its
+dest (or, for a label, its name), its type, its operands and its value.
+Whatever does not fit those fields (a parameterized type, a char value,
+source positions, ...) is kept as JSON in the string table, so
+converting JSON to binary and back gives the same JSON.
+"""
+
+import argparse
+import json
+import mmap
+import struct
+import sys
+
+import jsonstream
+from instr import Instr, json_hook
+
+MAGIC = b"\x89BRIL01\n"
+
+NONE = 0xFFFFFFFF
+MAX_OPERANDS = 0xFFFF
+
+# shape, op, dest or label, type, extra, first operand,
+# number of args, funcs and labels, value.
+RECORD = struct.Struct("<IIIIIIHHH2xq")
+# name, meta, offset of the records, number of records and operands.
+INDEX = struct.Struct("<IIQII")
+# offset of the string table, offset of the index, number of
+# functions, the program's other members, MAGIC.
+TRAILER = struct.Struct("<QQII8s")
+U32 = struct.Struct("<I")
+DOUBLE = struct.Struct("<d")
+INT64 = struct.Struct("<q")
+
+# Value kinds.
+NO_VALUE, INT, BOOL, FLOAT = range(4)
+
+OPERAND_KEYS = ("args", "funcs", "labels")
+
+
+STRING_KEYS = frozenset(("op", "dest", "label", "type"))
+
+
+def _fits(key, val):
+    """Whether `val` can go in the fixed field of a record for `key`."""
+    if key in STRING_KEYS:
+        return isinstance(val, str)
+    if key in OPERAND_KEYS:
+        return (isinstance(val, list) and len(val) <= MAX_OPERANDS
+                and all(isinstance(item, str) for item in val))
+    if key == "value":
+        if isinstance(val, bool) or isinstance(val, float):
+            return True
+        return isinstance(val, int) and -(1 << 63) <= val < (1 << 63)
+    return False
+
+
+class BinaryWriter:
+    """Write a Bril program in the binary format to the binary file `fp`,
+    one function at a time. Only the strings are kept in memory until
+    `close`, so `fp` can be a pipe.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.strings = {}
+        self.shapes = {}
+        self.index = []
+        self.offset = len(MAGIC)
+        fp.write(MAGIC)
+
+    def string(self, text):
+        num = self.strings.get(text)
+        if num is None:
+            num = self.strings[text] = len(self.strings)
+        return num
+
+    def json_string(self, val):
+        return self.string(json.dumps(val, separators=(",", ":")))
+
+    def record(self, instr, operands):
+        fields = {}
+        extra = {}
+        for key, val in instr.items():
+            if key == "label" and "dest" in instr or not _fits(key, val):
+                extra[key] = val
+            else:
+                fields[key] = val
+
+        name = fields.get("dest", fields.get("label"))
+        start = len(operands)
+        counts = []
+        for key in OPERAND_KEYS:
+            items = fields.get(key, ())
+            operands.extend(map(self.string, items))
+            counts.append(len(items))
+
+        value = fields.get("value")
+        if "value" not in fields:
+            kind, bits = NO_VALUE, 0
+        elif isinstance(value, bool):
+            kind, bits = BOOL, int(value)
+        elif isinstance(value, float):
+            kind, bits = FLOAT, INT64.unpack(DOUBLE.pack(value))[0]
+        else:
+            kind, bits = INT, value
+
+        shape = (kind,) + tuple(instr)
+        shape_id = self.shapes.get(shape)
+        if shape_id is None:
+            shape_id = self.shapes[shape] = self.json_string(list(shape))
+
+        return RECORD.pack(
+            shape_id,
+            self.string(fields["op"]) if "op" in fields else NONE,
+            self.string(name) if name is not None else NONE,
+            self.string(fields["type"]) if "type" in fields else NONE,
+            self.json_string(extra) if extra else NONE,
+            start, counts[0], counts[1], counts[2], bits)
+
+    def write_function(self, func):
+        operands = []
+        records = b"".join(self.record(instr, operands) for instr in func.get("instrs", ()))
+        self.fp.write(records)
+        self.fp.write(struct.pack("<{}I".format(len(operands)), *operands))
+        # The other members of the function, in order; name and instrs
+        # are stored on their own.
+        meta = [[key, None if key == "instrs" or key == "name" and isinstance(val, str) else val]
+                for key, val in func.items()]
+        name = func.get("name")
+        self.index.append(INDEX.pack(
+            self.string(name) if isinstance(name, str) else NONE, self.json_string(meta),
+            self.offset, len(records) // RECORD.size, len(operands)))
+        self.offset += len(records) + 4 * len(operands)
+
+    def close(self, extras=None):
+        """Write the string table, the index and the trailer. `extras`
+        holds the program's members other than `functions` (a program
+        dict itself works too).
+        """
+        members = [[key, None if key == "functions" else val] for key, val in (extras or {}).items()]
+        if not any(key == "functions" for key, _ in members):
+            members.insert(0, ["functions", None])
+        extras_id = self.json_string(members)
+
+        encoded = [text.encode() for text in self.strings]
+        offsets = [0]
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        strings_offset = self.offset
+        self.fp.write(U32.pack(len(encoded)))
+        self.fp.write(struct.pack("<{}I".format(len(offsets)), *offsets))
+        self.fp.write(b"".join(encoded))
+        index_offset = strings_offset + 4 * (len(offsets) + 1) + offsets[-1]
+        self.fp.write(b"".join(self.index))
+        self.fp.write(TRAILER.pack(strings_offset, index_offset, len(self.index), extras_id, MAGIC))
+
+
+def dump(prog, fp):
+    """Write the program `prog` to the binary file `fp`."""
+    writer = BinaryWriter(fp)
+    for func in prog["functions"]:
+        writer.write_function(func)
+    writer.close(prog)
+
+
+def _bits_to_float(bits):
+    return DOUBLE.unpack(INT64.pack(bits))[0]
+
+
+class _Strings(dict):
+    """The strings of a `BinaryProgram` decoded so far, by number. Any
+    other is decoded when it is first looked up.
+    """
+
+    def __init__(self, program):
+        super().__init__()
+        self.program = program
+
+    def __missing__(self, num):
+        text = self[num] = self.program._decode_string(num)
+        return text
+
+
+class BinaryProgram:
+    """A program in the binary format, read from a path or a binary file.
+    Regular files are mapped into memory rather than read.
+
+    It is a sequence of functions: `prog[i]` and iteration decode them
+    one by one, `function(name)` looks one up by name. `program()`
+    decodes everything into the usual JSON dict. With `compact`, the
+    instructions are decoded into `instr.Instr`s.
+    """
+
+    def __init__(self, source, compact=False):
+        self._map = None
+        if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+            with open(source, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            try:
+                self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError):
+                # A pipe or an in-memory file.
+                pass
+        self.data = self._map if self._map is not None else source.read()
+
+        if len(self.data) < len(MAGIC) + TRAILER.size or self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a binary Bril program")
+        (self._strings_offset, self._index_offset, self._count,
+         extras_id, magic) = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError("truncated binary Bril program")
+        self._string_count = U32.unpack_from(self.data, self._strings_offset)[0]
+        self._text_offset = self._strings_offset + 4 * (self._string_count + 2)
+        self._strings = _Strings(self)
+        self._decoders = {}
+        self._compact = compact
+        self._names = None
+        self._extras_id = extras_id
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, num):
+        return self._strings[num]
+
+    def _decode_string(self, num):
+        start, end = struct.unpack_from("<II", self.data, self._strings_offset + 4 + 4 * num)
+        return sys.intern(bytes(self.data[self._text_offset + start:self._text_offset + end]).decode())
+
+    def json_value(self, num):
+        """The value stored as JSON in string `num` (a new copy each
+        time, since it ends up inside the decoded instructions).
+        """
+        return json.loads(self.string(num))
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError("function index out of range")
+        return INDEX.unpack_from(self.data, self._index_offset + i * INDEX.size)
+
+    def name(self, i):
+        """The name of function `i`, without decoding the function."""
+        name_id = self._entry(i)[0]
+        return None if name_id == NONE else self.string(name_id)
+
+    def function(self, name):
+        """The function called `name`."""
+        if self._names is None:
+            self._names = {self.name(i): i for i in range(self._count)}
+        return self[self._names[name]]
+
+    def _decoder(self, shape_id, extra_keys=()):
+        """A function that turns a record (with its function's operands
+        and its extra members) back into an instruction. Records with
+        the same shape (keys and value kind) and extra members share
+        one, so the shape is only looked at once, when it is built.
+        """
+        kind, *keys = json.loads(self.string(shape_id))
+        strings = self._strings
+        get = strings.__getitem__
+
+        def args(r, O, X):
+            return list(map(get, O[r[5]:r[5] + r[6]]))
+
+        def funcs(r, O, X):
+            start = r[5] + r[6]
+            return list(map(get, O[start:start + r[7]]))
+
+        def labels(r, O, X):
+            start = r[5] + r[6] + r[7]
+            return list(map(get, O[start:start + r[8]]))
+
+        fields = {
+            "op": lambda r, O, X: strings[r[1]],
+            "dest": lambda r, O, X: strings[r[2]],
+            "label": lambda r, O, X: strings[r[2]],
+            "type": lambda r, O, X: strings[r[3]],
+            "args": args,
+            "funcs": funcs,
+            "labels": labels,
+            "value": {
+                INT: lambda r, O, X: r[9],
+                BOOL: lambda r, O, X: r[9] != 0,
+                FLOAT: lambda r, O, X: _bits_to_float(r[9]),
+            }.get(kind),
+        }
+
+        def extra(key):
+            return lambda r, O, X: X[key]
+
+        layout = [(key, extra(key) if key in extra_keys else fields[key]) for key in keys]
+
+        def decode(r, O, X):
+            return {key: field(r, O, X) for key, field in layout}
+        if self._compact:
+            return lambda r, O, X: Instr(decode(r, O, X))
+        return decode
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        name_id, meta_id, offset, count, operand_count = self._entry(i)
+        operands_offset = offset + count * RECORD.size
+        operands = struct.unpack_from("<{}I".format(operand_count), self.data, operands_offset)
+        decoders = self._decoders
+
+        instrs = []
+        for record in RECORD.iter_unpack(self.data[offset:operands_offset]):
+            if record[4] == NONE:
+                key = record[0]
+                extra = None
+            else:
+                extra = self.json_value(record[4])
+                key = (record[0], tuple(extra))
+            decode = decoders.get(key)
+            if decode is None:
+                decode = decoders[key] = self._decoder(record[0], extra or ())
+            instrs.append(decode(record, operands, extra))
+
+        func = {}
+        for key, val in self.json_value(meta_id):
+            if key == "name":
+                func[key] = self.string(name_id) if name_id != NONE else val
+            elif key == "instrs":
+                func[key] = instrs
+            else:
+                func[key] = val
+        return func
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def extras(self):
+        """The program's members other than `functions`."""
+        return {key: val for key, val in self.json_value(self._extras_id) if key != "functions"}
+
+    def program(self):
+        """The whole program, as `json.load` would return it."""
+        prog = {}
+        for key, val in self.json_value(self._extras_id):
+            prog[key] = list(self) if key == "functions" else val
+        return prog
+
+
+def is_binary(fp):
+    """Whether the text stream `fp` (usually stdin) holds a binary
+    program. Nothing is consumed. JSON cannot start with MAGIC's first
+    byte, so one byte is enough, and peeking it works on pipes too.
+    """
+    buffer = getattr(fp, "buffer", None)
+    if buffer is None or not hasattr(buffer, "peek"):
+        return False
+    return buffer.peek(1)[:1] == MAGIC[:1]
+
+
+def load_program(fp, compact=False):
+    """Read a whole program from the text stream `fp`, in either format.
+    With `compact`, the instructions are `instr.Instr`s.
+    """
+    if is_binary(fp):
+        with BinaryProgram(fp.buffer, compact) as prog:
+            return prog.program()
+    return json.load(fp, object_hook=json_hook if compact else None)
+
+
+def iter_functions(fp, extras=None, compact=False):
+    """Like `jsonstream.iter_functions`, for input in either format."""
+    if is_binary(fp):
+        with BinaryProgram(fp.buffer, compact) as prog:
+            if extras is not None:
+                extras.update(prog.extras())
+            yield from prog
+    else:
+        yield from jsonstream.iter_functions(fp, extras, object_hook=json_hook if compact else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a Bril program read from stdin between JSON and the binary format.")
+    parser.add_argument("-d", "--decode", action="store_true",
+                        help="print the program as JSON (the input can be either format)")
+    args = parser.parse_args()
+
+    prog = load_program(sys.stdin)
+    if args.decode:
+        print(json.dumps(prog, indent=2))
+    else:
+        dump(prog, sys.stdout.buffer)
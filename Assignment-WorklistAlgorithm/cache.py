@@ -0,0 +1,180 @@
+"""A persistent, content-addressed cache of per-function results.
+
+mycfg.py and df.py print a report for every function, and that report
+only depends on the function itself and on the mode or analysis. The
+cache stores each report under a hash of exactly those, so a function
+that has not changed since the last run is not analyzed again.
+
+Entries are zlib-compressed files in a directory, spread over 256
+subdirectories by the first two hex digits of their key. Each one is
+written to a temporary file and renamed into place, so several
+processes can share a cache: a reader sees either the whole entry or
+none of it. Reading an entry touches its modification time, and once
+the directory grows past its size limit the entries that were used
+least recently are deleted.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+
+from instr import json_default
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: evict without the lock.
+    fcntl = None
+
+# Change this when the format of an entry or of any cached report
+# changes, so that old entries stop matching.
+VERSION = 1
+
+MAGIC = b"BRILCACHE1\n"
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def function_key(func, kind):
+    """The key of `func`'s result for `kind` (a mode or analysis name).
+    It covers the function's name, which some reports print, and its
+    instructions, canonicalized (sorted object keys, no whitespace,
+    `Instr`s written as their dicts) so the key does not depend on how
+    the JSON was formatted or loaded.
+    """
+    canonical = json.dumps(
+        [VERSION, kind, func.get("name"), func["instrs"]],
+        sort_keys=True, separators=(",", ":"), default=json_default)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class Cache:
+    """A cache directory holding at most about `max_bytes` of entries."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None  # Bytes on disk, counted when first needed.
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, func, kind):
+        return function_key(func, kind)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """The text stored under `key`, or None."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        if not data.startswith(MAGIC):
+            return None
+        try:
+            return zlib.decompress(data[len(MAGIC):]).decode()
+        except (zlib.error, UnicodeDecodeError):
+            return None
+
+    def put(self, key, text):
+        """Store `text` under `key`, then evict if the cache is full."""
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        data = MAGIC + zlib.compress(text.encode())
+        fd, temp = tempfile.mkstemp(dir=folder, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise
+
+        if self.size is None:
+            self.size = self.disk_usage()
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """(mtime, size, path) of every entry."""
+        found = []
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.startswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+
+    def disk_usage(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Delete the least recently used entries until the cache is
+        below 90% of its limit. Only one process evicts at a time; the
+        others carry on without waiting.
+        """
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 9 // 10
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                total -= size
+            self.size = total
+
+
+_caches = {}
+
+
+def open_cache(directory, max_bytes=DEFAULT_MAX_BYTES):
+    """The `Cache` for `directory`, shared by all callers in this process."""
+    cache = _caches.get(directory)
+    if cache is None or cache.max_bytes != max_bytes:
+        cache = _caches[directory] = Cache(directory, max_bytes)
+    return cache
+
+
+def _run_cached(worker, directory, kind, max_bytes, func):
+    cache = open_cache(directory, max_bytes)
+    key = cache.key(func, kind)
+    text = cache.get(key)
+    if text is None:
+        text = worker(func)
+        cache.put(key, text)
+    return text
+
+
+def cached(worker, directory, kind, max_bytes=DEFAULT_MAX_BYTES):
+    """Wrap a per-function report function so that its results go
+    through the cache in `directory`. `kind` names what `worker`
+    computes; it is part of every key. The wrapper can be pickled if
+    `worker` can, so it works with `parallel.map_functions`.
+    """
+    return functools.partial(_run_cached, worker, directory, kind, max_bytes)
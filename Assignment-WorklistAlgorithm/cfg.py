@@ -1,8 +1,240 @@
+from array import array
 from collections import OrderedDict
+from collections.abc import Mapping
 from util import fresh, flatten
 from form_blocks import TERMINATORS
 
 
+class Block(list):
+    """A basic block: a list of instructions that also remembers the
+    summaries computed from it (see `summary`). Changing the list in any
+    way drops the summaries. Editing an instruction in place is not
+    seen by the list, so call `invalidate` after doing that.
+    """
+
+    __slots__ = ("summaries",)
+
+    def __init__(self, instrs=()):
+        super().__init__(instrs)
+        self.summaries = {}
+
+    def invalidate(self):
+        self.summaries.clear()
+
+    def _changed(method):
+        def wrapper(self, *args, **kwargs):
+            self.summaries.clear()
+            return method(self, *args, **kwargs)
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    __setitem__ = _changed(list.__setitem__)
+    __delitem__ = _changed(list.__delitem__)
+    __iadd__ = _changed(list.__iadd__)
+    __imul__ = _changed(list.__imul__)
+    append = _changed(list.append)
+    extend = _changed(list.extend)
+    insert = _changed(list.insert)
+    pop = _changed(list.pop)
+    remove = _changed(list.remove)
+    clear = _changed(list.clear)
+    sort = _changed(list.sort)
+    reverse = _changed(list.reverse)
+    del _changed
+
+
+class Adjacency(Mapping):
+    """One direction of a `CFG`'s edges, read like a dict that maps each
+    block name to the list of its neighbours' names.
+    """
+
+    __slots__ = ("graph", "offsets", "targets")
+
+    def __init__(self, graph, offsets, targets):
+        self.graph = graph
+        self.offsets = offsets
+        self.targets = targets
+
+    def __getitem__(self, name):
+        i = self.graph.ids[name]
+        names = self.graph.names
+        return [names[t] for t in self.targets[self.offsets[i]:self.offsets[i + 1]]]
+
+    def __iter__(self):
+        return iter(self.graph.names)
+
+    def __len__(self):
+        return len(self.graph.names)
+
+    def __contains__(self, name):
+        return name in self.graph.ids
+
+
+class CFG(Mapping):
+    """A control flow graph over named blocks in compact form.
+
+    Every block gets a dense integer ID in block order; `names[i]` and
+    `ids[name]` translate between the two. The edges are stored CSR-style
+    in `array('i')`s: the successors of block `i` are
+    `succ_targets[succ_offsets[i]:succ_offsets[i + 1]]`, and likewise for
+    the predecessors. Duplicate edges (a `br` with the same label twice)
+    are kept.
+
+    As a mapping, the graph reads like a dict from each block name to the
+    list of its successors' names. `preds` and `succs` give both
+    directions in that form. `traversals` is a cache for results computed
+    from the graph, which is never modified after it is built.
+    """
+
+    __slots__ = ("names", "ids", "succ_offsets", "succ_targets",
+                 "pred_offsets", "pred_targets", "traversals")
+
+    def __init__(self, names, successor_lists):
+        """Build the graph from the block names, in order, and an
+        iterable with the successor names of each block, in the same
+        order. Runs in time linear in the number of blocks and edges.
+        """
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.traversals = {}
+
+        ids = self.ids
+        offsets = array("i", [0])
+        targets = array("i")
+        for succs in successor_lists:
+            targets.extend(ids[succ] for succ in succs)
+            offsets.append(len(targets))
+        self.succ_offsets = offsets
+        self.succ_targets = targets
+
+        # Predecessors by counting sort on the edge targets.
+        n = len(self.names)
+        counts = array("i", [0]) * (n + 1)
+        for t in targets:
+            counts[t + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        self.pred_offsets = array("i", counts)
+        fill = counts
+        pred_targets = array("i", [0]) * len(targets)
+        for src in range(n):
+            for k in range(offsets[src], offsets[src + 1]):
+                t = targets[k]
+                pred_targets[fill[t]] = src
+                fill[t] += 1
+        self.pred_targets = pred_targets
+
+    @classmethod
+    def from_dict(cls, succs):
+        """Build a graph from a dict mapping names to successor lists."""
+        return cls(succs.keys(), succs.values())
+
+    def successor_ids(self, i):
+        return self.succ_targets[self.succ_offsets[i]:self.succ_offsets[i + 1]]
+
+    def predecessor_ids(self, i):
+        return self.pred_targets[self.pred_offsets[i]:self.pred_offsets[i + 1]]
+
+    @property
+    def succs(self):
+        return Adjacency(self, self.succ_offsets, self.succ_targets)
+
+    @property
+    def preds(self):
+        return Adjacency(self, self.pred_offsets, self.pred_targets)
+
+    def __getitem__(self, name):
+        return self.succs[name]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+
+def reverse_postorder(graph, start=0):
+    """The IDs of the blocks reachable from `start` in a `CFG`, in
+    reverse postorder of a depth-first search (explicit stack, so deep
+    graphs are fine).
+    """
+    visited = bytearray(len(graph))
+    visited[start] = 1
+    postorder = []
+    stack = [(start, iter(graph.successor_ids(start)))]
+    while stack:
+        node, succs = stack[-1]
+        for succ in succs:
+            if not visited[succ]:
+                visited[succ] = 1
+                stack.append((succ, iter(graph.successor_ids(succ))))
+                break
+        else:
+            stack.pop()
+            postorder.append(node)
+    postorder.reverse()
+    return postorder
+
+
+def immediate_dominator_ids(graph, start=0, order=None):
+    """Compute the dominator tree of a `CFG` with the iterative algorithm
+    of Cooper, Harvey and Kennedy. Returns an array holding the ID of
+    each block's immediate dominator: `start` maps to itself and blocks
+    that cannot be reached from it map to -1. `order` is the reverse
+    postorder from `start`, if the caller already has it.
+    """
+    if order is None:
+        order = reverse_postorder(graph, start)
+    rpo_number = array("i", [-1]) * len(graph)
+    for i, node in enumerate(order):
+        rpo_number[node] = i
+
+    idom = array("i", [-1]) * len(graph)
+    idom[start] = start
+
+    def intersect(a, b):
+        while a != b:
+            while rpo_number[a] > rpo_number[b]:
+                a = idom[a]
+            while rpo_number[b] > rpo_number[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            new_idom = -1
+            for pred in graph.predecessor_ids(node):
+                if idom[pred] >= 0:  # Already processed (so reachable).
+                    new_idom = pred if new_idom < 0 else intersect(pred, new_idom)
+            if idom[node] != new_idom:
+                idom[node] = new_idom
+                changed = True
+    return idom
+
+
+def summary(block, compute, *args):
+    """Return `compute(block, *args)`, cached on the block.
+
+    The result is computed the first time it is asked for and kept until
+    the block's instructions change. Blocks that are plain lists (not
+    built by `block_map`) are summarized again on every call. Callers
+    must not modify the returned value.
+    """
+    if not isinstance(block, Block):
+        return compute(block, *args)
+    key = (compute,) + args
+    try:
+        return block.summaries[key]
+    except KeyError:
+        value = block.summaries[key] = compute(block, *args)
+        return value
+
+
 def block_map(blocks):
     """Given a sequence of basic blocks, which are lists of instructions,
     produce a `OrderedDict` mapping names to blocks.
@@ -10,9 +242,13 @@ def block_map(blocks):
     The name of the block comes from the label it starts with, if any.
     Anonymous blocks, which don't start with a label, get an
     automatically generated name. Blocks in the mapping have their
-    labels removed.
+    labels removed and are `Block` objects, so they can cache their
+    summaries.
     """
     by_name = OrderedDict()
+    blocks = list(blocks)
+    # Made-up names must not clash with labels that come later.
+    taken = {block[0]["label"] for block in blocks if "label" in block[0]}
 
     for block in blocks:
         # Generate a name for the block.
@@ -23,10 +259,11 @@ def block_map(blocks):
             block = block[1:]
         else:
             # Make up a new name for this anonymous block.
-            name = fresh("b", by_name)
+            name = fresh("b", taken)
+            taken.add(name)
 
         # Add the block to the mapping.
-        by_name[name] = block
+        by_name[name] = Block(block)
 
     return by_name
 
@@ -49,20 +286,21 @@ def add_terminators(blocks):
     """Given an ordered block map, modify the blocks to add terminators
     to all blocks (avoiding "fall-through" control flow transfers).
     """
+    names = list(blocks.keys())
     for i, block in enumerate(blocks.values()):
         if not block:
             if i == len(blocks) - 1:
                 # In the last block, return.
                 block.append({"op": "ret", "args": []})
             else:
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({"op": "jmp", "labels": [dest]})
         elif block[-1]["op"] not in TERMINATORS:
             if i == len(blocks) - 1:
                 block.append({"op": "ret", "args": []})
             else:
                 # Otherwise, jump to the next block.
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({"op": "jmp", "labels": [dest]})
 
 
@@ -84,30 +322,41 @@ def add_entry(blocks):
 
     # References exist; insert a new block.
     new_lbl = fresh("entry", blocks)
-    blocks[new_lbl] = []
+    blocks[new_lbl] = Block()
     blocks.move_to_end(new_lbl, last=False)
 
 
+def flow_graph(blocks):
+    """Given a block map containing blocks complete with terminators,
+    build its `CFG`.
+    """
+    return CFG(blocks.keys(), (successors(block[-1]) for block in blocks.values()))
+
+
 def edges(blocks):
     """Given a block map containing blocks complete with terminators,
     generate two mappings: predecessors and successors. Both map block
     names to lists of block names.
     """
-    preds = {name: [] for name in blocks}
-    succs = {name: [] for name in blocks}
-    for name, block in blocks.items():
-        for succ in successors(block[-1]):
-            succs[name].append(succ)
-            preds[succ].append(name)
-    return preds, succs
+    graph = flow_graph(blocks)
+    return graph.preds, graph.succs
+
 
+def reassemble(blocks, elide_jumps=False):
+    """Flatten a CFG into an instruction list.
 
-def reassemble(blocks):
-    """Flatten a CFG into an instruction list."""
-    # This could optimize slightly by opportunistically eliminating
-    # `jmp .next` and `ret` terminators where it is allowed.
+    With `elide_jumps`, a `jmp` to the block that comes right after it
+    and a bare `ret` at the very end are left out, since control falls
+    through to the same place without them.
+    """
     instrs = []
     for name, block in blocks.items():
+        if (elide_jumps and instrs and instrs[-1].get("op") == "jmp"
+                and instrs[-1]["labels"] == [name]):
+            instrs.pop()
         instrs.append({"label": name})
         instrs += block
+    if (elide_jumps and instrs and instrs[-1].get("op") == "ret"
+            and not instrs[-1].get("args")):
+        instrs.pop()
     return instrs
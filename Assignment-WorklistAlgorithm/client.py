@@ -0,0 +1,130 @@
+"""Command line client for daemon.py.
+
+Sends the program on stdin to a running daemon and prints the answer
+exactly like the tool itself would have:
+
+    bril2json < prog.bril | python3 client.py mycfg -r
+    bril2json < prog.bril | python3 client.py df live --dense
+    bril2json < prog.bril | python3 client.py passes dce,df:live
+
+The program is passed on as it was read (only its line breaks are
+removed, which JSON allows outside of strings), so the client never
+parses it and only imports what it needs to talk to the socket. With
+`--spawn`, a daemon is started in the background if none is running.
+`--stop` shuts the daemon down.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+DAEMON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "daemon.py")
+
+
+def default_socket():
+    return os.environ.get("BRIL_DAEMON_SOCKET") or os.path.join(
+        "/tmp", "bril-daemon-{}.sock".format(os.getuid()))
+
+
+def connect(path, spawn=False, timeout=10.0):
+    """A socket connected to the daemon at `path`, which is started
+    first if `spawn` is set and nothing is listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return sock
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not spawn:
+            raise
+    subprocess.Popen([sys.executable, DAEMON, "--socket", path], start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            sock.connect(path)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+
+
+def request(sock, fields, program_text=None):
+    """Send one request and return the answer. `program_text` is the
+    JSON text of the program, spliced in without being parsed.
+    """
+    line = json.dumps(dict(fields, id=1))
+    if program_text is not None:
+        line = '{}, "program": {}}}'.format(line[:-1], program_text.replace("\n", " ").replace("\r", " "))
+    sock.sendall(line.encode() + b"\n")
+    data = b""
+    with sock.makefile("rb") as reply:
+        data = reply.readline()
+    if not data:
+        raise ConnectionError("the daemon closed the connection")
+    return json.loads(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run mycfg.py, df.py or passes.py on a Bril program from stdin through daemon.py.")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="the daemon's socket (default: $BRIL_DAEMON_SOCKET or /tmp/bril-daemon-UID.sock)")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a daemon if none is running")
+    parser.add_argument("--stop", action="store_true",
+                        help="shut the daemon down")
+    tools = parser.add_subparsers(dest="tool")
+
+    cfg = tools.add_parser("mycfg", help="a mycfg.py mode")
+    for letter in "clLpbr":
+        cfg.add_argument("-" + letter, dest="mode", action="store_const", const="-" + letter)
+
+    flow = tools.add_parser("df", help="a df.py analysis")
+    flow.add_argument("analysis")
+    flow.add_argument("--dense", action="store_true")
+    flow.add_argument("--schedule")
+    flow.add_argument("--savings", action="store_true")
+    flow.add_argument("--stats", action="store_const", const="text")
+    flow.add_argument("--stats-json", action="store_const", const="json", dest="stats")
+    flow.add_argument("--interproc", action="store_true")
+
+    pipeline = tools.add_parser("passes", help="a passes.py pipeline")
+    pipeline.add_argument("pipeline")
+    pipeline.add_argument("--dense", action="store_true")
+    pipeline.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    path = args.socket or default_socket()
+    if args.stop:
+        with connect(path) as sock:
+            request(sock, {"shutdown": True})
+        return
+    if args.tool == "mycfg":
+        if not args.mode:
+            cfg.error("choose a mode: -c, -l, -L, -p, -b or -r")
+        fields = {"mode": args.mode}
+    elif args.tool == "df":
+        fields = {"analysis": args.analysis, "options": {
+            "dense": args.dense, "schedule": args.schedule, "savings": args.savings,
+            "stats": args.stats, "interproc": args.interproc}}
+    elif args.tool == "passes":
+        fields = {"pipeline": args.pipeline, "options": {"dense": args.dense, "quiet": args.quiet}}
+    else:
+        parser.error("choose mycfg, df or passes")
+
+    with connect(path, args.spawn) as sock:
+        reply = request(sock, fields, sys.stdin.read())
+    if "error" in reply:
+        print(reply["error"], file=sys.stderr)
+        sys.exit(1)
+    sys.stderr.write(reply.get("stderr", ""))
+    sys.stdout.write(reply["output"])
+
+
+if __name__ == "__main__":
+    main()
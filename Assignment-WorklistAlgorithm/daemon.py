@@ -0,0 +1,321 @@
+"""A resident server for mycfg.py, df.py and passes.py.
+
+Starting Python, importing the tools and setting up the JSON machinery
+takes longer than analyzing a small program. The daemon pays for that
+once and then answers requests, one JSON object per line:
+
+    {"id": 1, "mode": "-r", "program": {...}}
+    {"id": 2, "analysis": "live", "options": {"dense": true}, "program": {...}}
+    {"id": 3, "pipeline": "dce,df:live", "program": {...}}
+
+A request with a `mode` runs mycfg.py, one with an `analysis` runs
+df.py and one with a `pipeline` runs passes.py. `options` holds the
+command line options of that tool by their long names (`dense`,
+`schedule`, `savings`, `stats` ("text" or "json"), `interproc` for df,
+`dense` and `quiet` for passes). The answer has the same `id`, the
+text the tool would have printed in `output` and whatever it printed
+to stderr in `stderr`, or an `error`. `{"shutdown": true}` stops the
+server.
+
+Requests are read from a Unix domain socket (`--socket PATH`, any
+number of connections) or from stdin with answers on stdout
+(`--stdio`). They are served concurrently with asyncio: the analyses
+run in a pool of `--jobs` worker processes (one per CPU by default)
+while the server keeps reading. With `--jobs 1` they run in a single
+worker thread instead, so requests are analyzed one at a time. Every per-function result is
+kept in memory under the hash of the function (see
+`cache.function_key`), so a function that comes back unchanged is not
+analyzed again.
+
+client.py is the matching command line client:
+
+    python3 daemon.py --socket /tmp/bril.sock &
+    bril2json < prog.bril | python3 client.py --socket /tmp/bril.sock mycfg -r
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import fcntl
+import functools
+import io
+import json
+import os
+import sys
+from collections import OrderedDict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "Assignment-WorkingWithCFGs"))
+
+import cache
+import df
+from client import default_socket
+import interproc
+import mycfg
+import passes
+from worklist import SCHEDULERS
+
+MYCFG_MODES = ("-c", "-l", "-L", "-p", "-b", "-r")
+
+# Requests can hold whole programs on one line.
+LINE_LIMIT = 1 << 30
+
+
+class RequestError(Exception):
+    """A request that cannot be served as asked."""
+
+
+class Memo:
+    """The per-function results computed so far, up to `size` of them;
+    the ones used least recently go first.
+    """
+
+    def __init__(self, size=1 << 16):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        return None
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+def run_batch(worker, functions):
+    """Run `worker` over `functions` in a pool worker. Returns the
+    results and what was printed to stderr.
+    """
+    err = io.StringIO()
+    with contextlib.redirect_stderr(err):
+        results = [worker(func) for func in functions]
+    return results, err.getvalue()
+
+
+def plan(request):
+    """Check a request and work out what to run. Returns the per-function
+    worker, the kind that names its results in the memo (None when they
+    cannot be reused) and a function that puts the final output
+    together from the program and the results.
+    """
+    options = dict(request.get("options") or {})
+
+    def concat(prog, results):
+        return "".join(results)
+
+    if "mode" in request:
+        mode = request["mode"]
+        if mode not in MYCFG_MODES:
+            raise RequestError("unknown mode {!r}; use {}".format(mode, ", ".join(MYCFG_MODES)))
+        return functools.partial(mycfg.cfg_report, mode=mode), "mycfg " + mode, concat
+
+    if "analysis" in request:
+        name = request["analysis"]
+        if name not in df.ANALYSES and name not in ("reaching", "available"):
+            raise RequestError("unknown analysis {!r}".format(name))
+        if options.get("schedule") not in (None, *SCHEDULERS):
+            raise RequestError("unknown schedule {!r}".format(options["schedule"]))
+        if options.get("stats") not in (None, False, "text", "json"):
+            raise RequestError("stats must be \"text\" or \"json\"")
+        worker = functools.partial(df.df_function, analysis_name=name,
+                                   dense=bool(options.get("dense")),
+                                   scheduler=options.get("schedule"),
+                                   savings=bool(options.get("savings")),
+                                   stats=options.get("stats") or None)
+        # The stderr reports need the solver to run, like with --cache.
+        kind = None if options.get("savings") or options.get("stats") else "df {} {}".format(
+            name, json.dumps([bool(options.get("dense")), options.get("schedule")]))
+        return worker, kind, concat
+
+    if "pipeline" in request:
+        try:
+            steps = passes.parse_pipeline(request["pipeline"])
+        except ValueError as err:
+            raise RequestError(str(err))
+        dense = bool(options.get("dense"))
+
+        def assemble(prog, results):
+            text = "".join(report for report, _ in results)
+            if all(kind == "pass" for kind, _ in steps):
+                functions = [dict(func, instrs=instrs) for func, (_, instrs) in zip(prog["functions"], results)]
+                text += json.dumps(dict(prog, functions=functions), indent=2) + "\n"
+            return text
+
+        kind = "passes {} {}".format(json.dumps(steps), dense)
+        return functools.partial(passes.run_function, steps=steps, dense=dense), kind, assemble
+
+    raise RequestError("a request needs a mode, an analysis or a pipeline")
+
+
+def take_lock(path):
+    """Open and lock the file `path`, or return None if another process
+    holds the lock. Only the daemon holding it may replace the socket,
+    so two clients spawning a daemon at once do not end up with two.
+
+    The holder unlinks the file when it stops, so a file locked after
+    that happened is no longer the one at `path`; then it is tried again.
+    """
+    while True:
+        lock = open(path, "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        try:
+            if os.path.samestat(os.fstat(lock.fileno()), os.stat(path)):
+                return lock
+        except FileNotFoundError:
+            pass
+        lock.close()
+
+
+class Server:
+    """Serves requests from any number of streams with one memo."""
+
+    def __init__(self, jobs=1, memo_size=1 << 16):
+        if jobs > 1:
+            self.executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        else:
+            # Capturing stderr swaps sys.stderr for the whole process, so
+            # with one job the analyses run one at a time, in one thread.
+            self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.memo = Memo(memo_size)
+        self.stopped = asyncio.Event()
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def answer(self, request):
+        """Serve one request and return the answer (without its id)."""
+        if request.get("shutdown"):
+            self.stopped.set()
+            return {"output": ""}
+        prog = request.get("program")
+        if not isinstance(prog, dict) or not isinstance(prog.get("functions", []), list):
+            raise RequestError("a request needs a Bril program")
+        worker, kind, assemble = plan(request)
+        functions = prog.get("functions", [])
+        stderr = ""
+
+        if "analysis" in request and (request.get("options") or {}).get("interproc"):
+            # Summaries depend on the whole program, so nothing is reused.
+            summaries = await self.run(interproc.summarize, functions)
+            worker = functools.partial(worker, summaries=summaries)
+            kind = None
+
+        keys = [cache.function_key(func, kind) if kind else None for func in functions]
+        results = [self.memo.get(key) if key else None for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed, stderr = await self.run(run_batch, worker, [functions[i] for i in missing])
+            for i, result in zip(missing, computed):
+                results[i] = result
+                if keys[i]:
+                    self.memo.put(keys[i], result)
+        if (request.get("options") or {}).get("quiet"):
+            stderr = ""
+        return {"output": assemble(prog, results), "stderr": stderr}
+
+    async def handle(self, line, write):
+        """Answer one request line by calling `write` with the answer."""
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("a request has to be a JSON object")
+            request_id = request.get("id")
+            reply = await self.answer(request)
+        except (RequestError, ValueError) as err:
+            reply = {"error": str(err)}
+        except Exception as err:  # A failing analysis must not stop the server.
+            reply = {"error": "{}: {}".format(type(err).__name__, err)}
+        reply["id"] = request_id
+        await write((json.dumps(reply) + "\n").encode())
+
+    async def serve_stream(self, reader, write):
+        """Read request lines from `reader` until it ends or the server
+        stops, answering each one as soon as it is done.
+        """
+        tasks = set()
+        while not self.stopped.is_set():
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(self.handle(line, write))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def serve_socket(self, path):
+        async def connection(reader, writer):
+            async def write(data):
+                writer.write(data)
+                await writer.drain()
+            try:
+                await self.serve_stream(reader, write)
+            finally:
+                writer.close()
+
+        lock = take_lock(path + ".lock")
+        if lock is None:
+            print("another daemon is serving {}".format(path), file=sys.stderr)
+            return
+        with lock:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(connection, path, limit=LINE_LIMIT)
+            try:
+                async with server:
+                    await self.stopped.wait()
+            finally:
+                # Unlinked while still locked; see `take_lock`.
+                for name in (path, path + ".lock"):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(name)
+
+    async def serve_stdio(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=LINE_LIMIT)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        out = sys.stdout.buffer
+
+        async def write(data):
+            out.write(data)
+            out.flush()
+
+        await self.serve_stream(reader, write)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve mycfg.py, df.py and passes.py requests from a resident process.")
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument("--socket", metavar="PATH",
+                       help="listen on this Unix domain socket (default: $BRIL_DAEMON_SOCKET or /tmp/bril-daemon-UID.sock)")
+    where.add_argument("--stdio", action="store_true",
+                       help="read requests from stdin and write the answers to stdout")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, metavar="N",
+                        help="run the analyses in N worker processes (default: one per CPU; "
+                             "with 1, requests are analyzed one at a time)")
+    args = parser.parse_args()
+
+    server = Server(args.jobs)
+    try:
+        if args.stdio:
+            asyncio.run(server.serve_stdio())
+        else:
+            asyncio.run(server.serve_socket(args.socket or default_socket()))
+    finally:
+        server.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,36 @@
 import sys
-import json
+import time
+import argparse
+import functools
 from collections import namedtuple
 
 from form_blocks import form_blocks
+from bitset import Domain, BitSet
+from env import Env, EMPTY, changed_names
+from worklist import SCHEDULERS
+from stats import WorklistStats
+import brilbin
+import parallel
+import cache
 import cfg
+import interproc
 
 # A single dataflow analysis consists of these part:
 # - forward: True for forward, False for backward.
 # - init: An initial value (bottom or top of the latice).
 # - merge: Take a list of values and produce a single value.
 # - transfer: The transfer function.
-
-Analysis = namedtuple("Analysis", ["forward", "init", "merge", "transfer"])
+# - scheduler: Which worklist order to use (a key of `SCHEDULERS`).
+#   "rpo" visits blocks in reverse postorder (postorder for backward
+#   analyses) and queues each block at most once; "fifo" is the plain
+#   first-in first-out queue.
+# - incremental: Whether df_incremental can reuse an old solution. False
+#   when the lattice itself is built from the whole function (the set of
+#   all expressions, or the numbering of the dense backends), since then
+#   an edit anywhere can change every value.
+
+Analysis = namedtuple("Analysis", ["forward", "init", "merge", "transfer", "scheduler", "incremental"],
+                      defaults=("rpo", True))
 
 # Union Method
 def union(sets):
@@ -20,13 +39,81 @@ def union(sets):
         out.update(s)
     return out    
 
+# Merges for bit-vector facts.
+def bit_union(domain):
+    def merge(bitsets):
+        bits = 0
+        for b in bitsets:
+            bits |= b.bits
+        return BitSet(domain, bits)
+    return merge
+
+def bit_intersection(domain):
+    def merge(bitsets):
+        bits = domain.full_mask()
+        for b in bitsets:
+            bits &= b.bits
+        return BitSet(domain, bits)
+    return merge
+
 # Worklist algoritm
-def df_worklist(blocks, analysis):
+def df_worklist(blocks, analysis, scheduler=None, stats=None):
     """The worklist algorithm for iterating a data flow analysis to a
-    fixed point.
+    fixed point. `scheduler` overrides the analysis's own worklist
+    order. A `WorklistStats` passed as `stats` is filled in with what
+    the solver did; without one the plain loop runs, with no counting
+    at all.
     """
     
-    preds, succs = cfg.edges(blocks)
+    edges = cfg.edges(blocks)
+    out = {node: analysis.init for node in blocks}
+    return solve(blocks, analysis, edges, {}, out, blocks.keys(), scheduler, stats)
+
+# Incremental re-solving
+def df_incremental(blocks, analysis, solution, dirty, scheduler=None, stats=None):
+    """Update the `solution` that `df_worklist` (or this function)
+    returned for `blocks` after the blocks named in `dirty` were edited,
+    and return the new solution. It is the same as solving from scratch.
+
+    Only the dirty blocks and the blocks downstream of them (in the
+    direction of the analysis) can have new values. Those restart from
+    `analysis.init` and are solved again; everything else keeps its old
+    value. Blocks that are not in the old solution count as dirty. If an
+    edit adds or removes CFG edges, both ends of those edges have to be
+    in `dirty`.
+
+    Analyses that are not `incremental` are solved from scratch.
+    """
+    edges = cfg.edges(blocks)
+    preds, succs = edges
+    if analysis.forward:
+        old_in, old_out = solution
+        out_edges = succs
+    else:
+        old_out, old_in = solution
+        out_edges = preds
+
+    if not analysis.incremental:
+        affected = set(blocks)
+    else:
+        affected = {node for node in dirty if node in blocks}
+        affected.update(node for node in blocks if node not in old_out)
+    stack = list(affected)
+    while stack:
+        for n in out_edges[stack.pop()]:
+            if n not in affected:
+                affected.add(n)
+                stack.append(n)
+
+    in_ = {node: old_in[node] for node in blocks if node not in affected}
+    out = {node: analysis.init if node in affected else old_out[node] for node in blocks}
+    seeds = [node for node in blocks if node in affected]
+    return solve(blocks, analysis, edges, in_, out, seeds, scheduler, stats)
+
+# The shared loop of df_worklist and df_incremental: iterate from the
+# given `in_` and `out` values, starting with the `seeds` blocks.
+def solve(blocks, analysis, edges, in_, out, seeds, scheduler=None, stats=None):
+    preds, succs = edges
 
     # Switch between directions.
     if analysis.forward:
@@ -40,13 +127,14 @@ def df_worklist(blocks, analysis):
 
     # Initialize.
 
-    in_ = {first_block: analysis.init}
-    out = {node: analysis.init for node in blocks}
+    in_.setdefault(first_block, analysis.init)
 
     # Iterate.
-    worklist = list(blocks.keys())
+    worklist = SCHEDULERS[scheduler or analysis.scheduler](blocks, succs, analysis.forward, seeds)
+    if stats is not None:
+        iterate_counted(blocks, analysis, worklist, in_edges, out_edges, in_, out, stats)
     while worklist:
-        node = worklist.pop(0)
+        node = worklist.pop()
 
         inval = analysis.merge(out[n] for n in in_edges[node])
         in_[node] = inval
@@ -55,18 +143,68 @@ def df_worklist(blocks, analysis):
 
         if outval != out[node]:
             out[node] = outval
-            worklist += out_edges[node]
+            for n in out_edges[node]:
+                worklist.push(n)
 
     if analysis.forward:
         return in_, out
     else:
         return out, in_
 
+# The loop of solve with counters and timers. It empties the
+# worklist, so the plain loop after it has nothing left to do.
+def iterate_counted(blocks, analysis, worklist, in_edges, out_edges, in_, out, stats):
+    clock = time.perf_counter
+    changed = stats.changed
+    for node in blocks:
+        changed.setdefault(node, 0)
+    while worklist:
+        node = worklist.pop()
+        stats.pops += 1
+
+        start = clock()
+        inval = analysis.merge(out[n] for n in in_edges[node])
+        stats.merge_seconds += clock() - start
+        stats.merges += 1
+        in_[node] = inval
+
+        start = clock()
+        outval = analysis.transfer(blocks[node], inval, node)
+        stats.transfer_seconds += clock() - start
+        stats.transfers += 1
+
+        if outval != out[node]:
+            out[node] = outval
+            changed[node] += 1
+            for n in out_edges[node]:
+                worklist.push(n)
+                stats.pushes += 1
+
+# Count transfer evaluations
+def count_transfers(blocks, analysis, scheduler=None):
+    """Solve the analysis and return how many times it evaluated a
+    transfer function.
+    """
+    stats = WorklistStats()
+    df_worklist(blocks, analysis, scheduler, stats)
+    return stats.transfers
+
+def transfer_savings(blocks, analysis, scheduler=None):
+    """Compare the transfer evaluations of a scheduler against the
+    FIFO worklist. Returns (fifo count, scheduler count).
+    """
+    return (count_transfers(blocks, analysis, "fifo"),
+            count_transfers(blocks, analysis, scheduler))
+
 # Formatting helper method
 def fmt(val):
     """Guess a good way to format a data flow value. (Works for sets and
     dicts, at least.)
     """
+    if isinstance(val, BitSet):
+        val = val.to_set()
+    elif isinstance(val, Env):
+        val = val.flat()
     if isinstance(val, set):
         if val:
             return ", ".join(str(v) for v in sorted(val))
@@ -80,67 +218,158 @@ def fmt(val):
     else:
         return str(val)
 
-# Main method -> runs analysis
-def run_df(bril, analysis_name):
-    for func in bril["functions"]:
-        # Form the CFG.
-        blocks = cfg.block_map(form_blocks(func["instrs"]))
-        cfg.add_terminators(blocks)
-        
-        if analysis_name == "reaching":
-            analysis = reaching_defs(blocks)
-        elif analysis_name == "available":
-            analysis = available_expressions(blocks)
-        else:
-            analysis = ANALYSES[analysis_name]
-
-        in_, out = df_worklist(blocks, analysis)
-        for block in blocks:
-            print("{}:".format(block))
-            print("  in: ", fmt(in_[block]))
-            print("  out:", fmt(out[block]))
-
-# Helper methods
+# The block map the analyses run over
+def function_blocks(func):
+    blocks = cfg.block_map(form_blocks(func["instrs"]))
+    cfg.add_terminators(blocks)
+    return blocks
+
+# Runs the analysis over one function and returns what it prints
+def df_function(func, analysis_name, dense=False, scheduler=None, savings=False, stats=None,
+                blocks=None, summaries=None):
+    # Form the CFG, unless the caller already has it (from function_blocks).
+    if blocks is None:
+        blocks = function_blocks(func)
+    
+    if analysis_name == "reaching":
+        analysis = reaching_defs(blocks, dense)
+    elif analysis_name == "available":
+        analysis = available_expressions(blocks, dense)
+    elif summaries is not None and analysis_name in CALL_AWARE:
+        analysis = CALL_AWARE[analysis_name](summaries)
+    else:
+        analysis = ANALYSES[analysis_name]
+
+    if savings:
+        scheduler_name = scheduler or analysis.scheduler
+        fifo, scheduled = transfer_savings(blocks, analysis, scheduler_name)
+        print("{}: {} transfers with {}, {} with fifo ({} saved)".format(
+            func["name"], scheduled, scheduler_name, fifo, fifo - scheduled),
+            file=sys.stderr)
+
+    collector = WorklistStats(func["name"]) if stats else None
+    in_, out = df_worklist(blocks, analysis, scheduler, collector)
+    if stats == "json":
+        print(collector.to_json(), file=sys.stderr)
+    elif stats:
+        sys.stderr.write(collector.format())
+
+    lines = []
+    for block in blocks:
+        lines.append("{}:\n".format(block))
+        lines.append("  in:  {}\n".format(fmt(in_[block])))
+        lines.append("  out: {}\n".format(fmt(out[block])))
+    return "".join(lines)
+
+# Main method -> runs analysis. With jobs > 1 the functions are
+# analyzed in that many worker processes; results still print in order.
+def run_df(bril, analysis_name, jobs=1, cache_dir=None, interprocedural=False, **options):
+    if interprocedural:
+        options["summaries"] = interproc.summarize(bril["functions"], jobs)
+    report = df_reporter(analysis_name, cache_dir, **options)
+    for text in parallel.map_functions(report, bril["functions"], jobs):
+        sys.stdout.write(text)
+
+# Streaming version of run_df: parses one function at a time from `fp`
+# (JSON or the binary format of brilbin.py)
+# and prints its result before reading the next one
+def stream_df(fp, analysis_name, jobs=1, cache_dir=None, compact=False, **options):
+    report = df_reporter(analysis_name, cache_dir, **options)
+    for text in parallel.map_functions(report, brilbin.iter_functions(fp, compact=compact), jobs):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+# The per-function job of run_df and stream_df. With a cache directory,
+# functions whose report is already cached are not analyzed again. The
+# stderr reports (savings, stats) need the solver to run, so asking for
+# them turns the cache off, and so do call summaries, which depend on
+# the other functions.
+def df_reporter(analysis_name, cache_dir=None, **options):
+    report = functools.partial(df_function, analysis_name=analysis_name, **options)
+    if cache_dir and not (options.get("savings") or options.get("stats") or options.get("summaries")):
+        report = cache.cached(report, cache_dir, "df " + analysis_name)
+    return report
+
+# Helper methods. Each one summarizes a single block; the transfer
+# functions get them through `cfg.summary`, so a block is only scanned
+# again after its instructions change.
 def gen(block):
     """Variables that are written in the block."""
     return {i["dest"] for i in block if "dest" in i}
 
 
-def use(block):
-    """Variables that are read before they are written in the block."""
+def use(block, summaries=None):
+    """Variables that are read before they are written in the block.
+    With `summaries` (see interproc.py), a call only reads the arguments
+    its callee can read.
+    """
     defined = set()  # Locally defined.
     used = set()
     for i in block:
-        used.update(v for v in i.get("args", []) if v not in defined)
+        args = i.get("args", [])
+        if summaries and i.get("op") == "call" and i["funcs"][0] in summaries:
+            live_args = summaries[i["funcs"][0]].live_args
+            if live_args is not None:
+                args = [v for k, v in enumerate(args) if k in live_args]
+        used.update(v for v in args if v not in defined)
         if "dest" in i:
             defined.add(i["dest"])
     return used
 
 
-def cprop_transfer(block, in_vals, _=None):
-    out_vals = dict(in_vals)
+def const_defs(block, summaries=None):
+    """The value each variable written in the block holds at its end:
+    the constant for a `const`, "?" for anything else. With `summaries`,
+    also the constant a call's callee always returns.
+    """
+    vals = {}
     for instr in block:
         if "dest" in instr:
             if instr["op"] == "const":
-                out_vals[instr["dest"]] = instr["value"]
+                vals[instr["dest"]] = instr["value"]
+            elif (summaries and instr["op"] == "call" and instr["funcs"][0] in summaries
+                  and summaries[instr["funcs"][0]].returns not in (None, "?")):
+                vals[instr["dest"]] = summaries[instr["funcs"][0]].returns
             else:
-                out_vals[instr["dest"]] = "?"
-    return out_vals
+                vals[instr["dest"]] = "?"
+    return vals
+
+
+# The environments are persistent `Env`s: a block's output is an overlay
+# of the block's (cached) constants on its input, so nothing is copied,
+# and revisiting a block whose input is the same object gives an output
+# that compares equal to the old one in constant time.
+def cprop_transfer(block, in_vals, _=None):
+    return in_vals.overlay(cfg.summary(block, const_defs))
 
 
 def cprop_merge(vals_list):
-    out_vals = {}
-    for vals in vals_list:
-        for name, val in vals.items():
-            if val == "?":
-                out_vals[name] = "?"
-            else:
-                if name in out_vals:
-                    if out_vals[name] != val:
-                        out_vals[name] = "?"
-                else:
-                    out_vals[name] = val
-    return out_vals
+    envs = list(vals_list)
+    if not envs:
+        return EMPTY
+    # With one distinct input (a single predecessor, or all of them
+    # agreeing on the same object) the merge is that input.
+    first = envs[0]
+    if all(env is first for env in envs):
+        return first
+    # Otherwise the result is an overlay over the first input, with the
+    # names whose merged value is not the one it already has. Only names
+    # bound since the inputs' common ancestor can disagree.
+    delta = {}
+    for name in changed_names(envs):
+        merged = first.get(name)
+        for env in envs:
+            val = env.get(name)
+            if val is None:
+                continue
+            if merged is None:
+                merged = val
+            elif merged != val:
+                merged = "?"
+                break
+        if merged is not None and (name not in first or first[name] != merged):
+            delta[name] = merged
+    return first.overlay(delta)
 
 # REACHING DEFS
 
@@ -148,25 +377,20 @@ def cprop_merge(vals_list):
 def gen_reach(block, label):
     return {(instr["dest"], label) for instr in block if "dest" in instr}
 
-def kill_reach(block, label, all_defs):
-    kill_set = set()
-    for instr in block:
-        if "dest" in instr:
-            var = instr["dest"]
-            kill_set |= {d for d in all_defs if d[0]==var and d[1] != label}
-    return kill_set
+# The block kills every incoming definition of a variable it writes, so
+# the kill set never has to be built: the survivors are filtered by the
+# block's (cached) set of written variables.
+def kill_reach(in_vals, defined):
+    return {d for d in in_vals if d[0] not in defined}
 
 # reaching defintions analysis
-def reaching_defs(blocks):
-    all_defs = set()
-    for label, block in blocks.items():
-        for instr in block:
-            if "dest" in instr:
-                all_defs.add((instr["dest"],label))
-                
+def reaching_defs(blocks, dense=False):
+    if dense:
+        return reaching_defs_dense(blocks)
+
     #transfer function for reach    
     def reach_transfer(block, in_vals, label):
-        return gen_reach(block, label) | (in_vals - kill_reach(block, label, all_defs))
+        return cfg.summary(block, gen_reach, label) | kill_reach(in_vals, cfg.summary(block, gen))
     
     return Analysis(
         True,
@@ -174,6 +398,39 @@ def reaching_defs(blocks):
         merge=union,
         transfer=reach_transfer)  
 
+# Bit-vector version of reaching definitions. Every (var, label)
+# definition is numbered once, and the gen/kill masks of each block are
+# computed up front instead of on every transfer.
+def reaching_defs_dense(blocks):
+    domain = Domain()
+    defs_of_var = {}
+    gen_masks = {}
+    for label, block in blocks.items():
+        gen_mask = 0
+        for instr in block:
+            if "dest" in instr:
+                bit = domain.add((instr["dest"], label))
+                gen_mask |= bit
+                defs_of_var[instr["dest"]] = defs_of_var.get(instr["dest"], 0) | bit
+        gen_masks[label] = gen_mask
+
+    kill_masks = {}
+    for label, block in blocks.items():
+        kill_mask = 0
+        for var in {instr["dest"] for instr in block if "dest" in instr}:
+            kill_mask |= defs_of_var[var]
+        kill_masks[label] = kill_mask & ~gen_masks[label]
+
+    def reach_transfer(block, in_vals, label):
+        return BitSet(domain, gen_masks[label] | (in_vals.bits & ~kill_masks[label]))
+
+    return Analysis(
+        True,
+        init=domain.empty(),
+        merge=bit_union(domain),
+        transfer=reach_transfer,
+        incremental=False)
+
 # AVAILABLE EXPRESSIONS
 
 # Helper function for available expression
@@ -185,25 +442,23 @@ def gen_expr(block):
     return gen_set
             
 
-def kill_expr(block, all_exprs):
-    kill_set = set()
-    def_vars = {instr["dest"] for instr in block if "dest" in instr}
-    for expr in all_exprs:
-        if any(var in def_vars for var in expr[1]):
-            kill_set.add(expr)
-    return kill_set
+# Like kill_reach: keep the incoming expressions whose operands the
+# block does not write.
+def kill_expr(in_vals, defined):
+    return {expr for expr in in_vals if defined.isdisjoint(expr[1])}
             
 #available expression analysis
 
-def available_expressions(blocks):
+def available_expressions(blocks, dense=False):
+    if dense:
+        return available_expressions_dense(blocks)
+
     universal_set = set() 
     for block in blocks.values():
-        for instr in block:
-            if instr["op"] in {"add", "sub", "mul", "div"}:
-                universal_set.add((instr["op"], tuple(instr["args"])))
+        universal_set |= cfg.summary(block, gen_expr)
     
     def available_transfer(block, in_vals, _=None):
-        return gen_expr(block) | (in_vals - kill_expr(block, universal_set))
+        return cfg.summary(block, gen_expr) | kill_expr(in_vals, cfg.summary(block, gen))
     
     def intersection(sets):
         if not sets:
@@ -217,7 +472,80 @@ def available_expressions(blocks):
         True,
         init=universal_set,
         merge=intersection,
-        transfer=available_transfer)
+        transfer=available_transfer,
+        incremental=False)
+
+# Bit-vector version of available expressions.
+def available_expressions_dense(blocks):
+    domain = Domain()
+    exprs_using_var = {}
+    gen_masks = {}
+    for label, block in blocks.items():
+        gen_mask = 0
+        for instr in block:
+            if instr["op"] in {"add", "sub", "mul", "div"}:
+                expr = (instr["op"], tuple(instr["args"]))
+                bit = domain.add(expr)
+                gen_mask |= bit
+                for var in expr[1]:
+                    exprs_using_var[var] = exprs_using_var.get(var, 0) | bit
+        gen_masks[label] = gen_mask
+
+    kill_masks = {}
+    for label, block in blocks.items():
+        kill_mask = 0
+        for instr in block:
+            if "dest" in instr:
+                kill_mask |= exprs_using_var.get(instr["dest"], 0)
+        kill_masks[label] = kill_mask
+
+    def available_transfer(block, in_vals, label):
+        return BitSet(domain, gen_masks[label] | (in_vals.bits & ~kill_masks[label]))
+
+    return Analysis(
+        True,
+        init=domain.full(),
+        merge=bit_intersection(domain),
+        transfer=available_transfer,
+        incremental=False)
+
+# CALL-AWARE ANALYSES
+
+# live and cprop with the summaries of interproc.py at call sites. The
+# block summaries are cached under a function made for these summaries.
+def live_variables(summaries):
+    def uses(block):
+        return use(block, summaries)
+
+    return Analysis(
+        False,
+        init=set(),
+        merge=union,
+        transfer=lambda block, out, _: cfg.summary(block, uses).union(out - cfg.summary(block, gen)))
+
+# `params` are bound to "?" where the function starts (the merge of no
+# inputs), so reassigning one on some paths does not make it look
+# constant. That needs an entry block without predecessors.
+def constant_propagation(summaries, params=()):
+    def consts(block):
+        return const_defs(block, summaries)
+
+    entry = EMPTY.overlay({name: "?" for name in params})
+
+    def merge(vals_list):
+        envs = list(vals_list)
+        return cprop_merge(envs) if envs else entry
+
+    return Analysis(
+        True,
+        init=EMPTY,
+        merge=merge,
+        transfer=lambda block, in_vals, _: in_vals.overlay(cfg.summary(block, consts)))
+
+CALL_AWARE = {
+    "live": live_variables,
+    "cprop": constant_propagation,
+}
 
 # Built-in Analyses
 ANALYSES = {
@@ -227,7 +555,7 @@ ANALYSES = {
         True,
         init=set(),
         merge=union,
-        transfer=lambda block, in_, _: in_.union(gen(block)),
+        transfer=lambda block, in_, _: in_.union(cfg.summary(block, gen)),
     ),
     # Live variable analysis: the variables that are both defined at a
     # given point and might be read along some path in the future.
@@ -235,17 +563,48 @@ ANALYSES = {
         False,
         init=set(),
         merge=union,
-        transfer=lambda block, out, _: use(block).union(out - gen(block)),
+        transfer=lambda block, out, _: cfg.summary(block, use).union(out - cfg.summary(block, gen)),
     ),
     # A simple constant propagation pass.
     "cprop": Analysis(
         True,
-        init={},
+        init=EMPTY,
         merge=cprop_merge,
         transfer=cprop_transfer,
     ),
 }
 
 if __name__ == "__main__":
-    bril = json.load(sys.stdin)
-    run_df(bril, sys.argv[1])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run a data flow analysis over a Bril program read from stdin.")
+    parser.add_argument("analysis", help="defined, live, cprop, reaching or available")
+    parser.add_argument("--dense", action="store_true",
+                        help="use the bit-vector backend for reaching and available")
+    parser.add_argument("--schedule", choices=sorted(SCHEDULERS),
+                        help="worklist order (default: the analysis's own, usually rpo)")
+    parser.add_argument("--savings", action="store_true",
+                        help="report on stderr how many transfers the schedule saved over fifo")
+    parser.add_argument("--stats", action="store_const", const="text",
+                        help="report on stderr, for each function, the worklist, merge and transfer counts and times")
+    parser.add_argument("--stats-json", action="store_const", const="json", dest="stats",
+                        help="like --stats, as one JSON object per function")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse and analyze one function at a time")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="analyze functions in N worker processes")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse the results of unchanged functions from this cache directory")
+    parser.add_argument("--compact", action="store_true",
+                        help="hold the instructions as compact Instr objects instead of JSON dicts")
+    parser.add_argument("--interproc", action="store_true",
+                        help="use summaries of the called functions at call sites (live and cprop)")
+    args = parser.parse_args()
+    if args.interproc and args.stream:
+        parser.error("--interproc needs the whole program and cannot be used with --stream")
+
+    options = dict(jobs=args.jobs, dense=args.dense, scheduler=args.schedule, savings=args.savings,
+                   stats=args.stats, cache_dir=args.cache)
+    if args.stream:
+        stream_df(sys.stdin, args.analysis, compact=args.compact, **options)
+    else:
+        bril = brilbin.load_program(sys.stdin, compact=args.compact)
+        run_df(bril, args.analysis, interprocedural=args.interproc, **options)
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""Persistent variable environments for constant propagation.
+
+A constant propagation value maps every variable to what is known about
+it. Most blocks only write a few variables, so copying the whole map for
+each block visit wastes time and memory. An `Env` is immutable and can
+be an overlay: the few bindings a block wrote on top of the environment
+it started from, which is shared rather than copied. Comparing two
+overlays of the same parent with the same bindings takes constant time,
+so a block whose input did not change costs almost nothing to check.
+"""
+
+from collections.abc import Mapping
+
+# Overlays deeper than this are flattened into a new base environment,
+# so lookups never walk long chains.
+MAX_DEPTH = 32
+
+
+class Env(Mapping):
+    """An immutable mapping, either a base dict or a `delta` of new
+    bindings over a `parent` Env. Neither dict may change afterwards.
+    """
+
+    __slots__ = ("delta", "parent", "depth", "_flat")
+
+    def __init__(self, delta=None, parent=None):
+        self.delta = {} if delta is None else delta
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        # The complete mapping, built on first use for overlays.
+        self._flat = self.delta if parent is None else None
+
+    def overlay(self, delta):
+        """The Env with the bindings of `delta` added to these. `delta`
+        is kept, not copied.
+        """
+        if not delta:
+            return self
+        if self.depth >= MAX_DEPTH:
+            flat = dict(self.flat())
+            flat.update(delta)
+            return Env(flat)
+        return Env(delta, self)
+
+    def flat(self):
+        """All bindings as one dict (shared: do not modify it)."""
+        if self._flat is None:
+            deltas = []
+            env = self
+            while env._flat is None:
+                deltas.append(env.delta)
+                env = env.parent
+            flat = dict(env._flat)
+            for delta in reversed(deltas):
+                flat.update(delta)
+            self._flat = flat
+        return self._flat
+
+    def __getitem__(self, name):
+        env = self
+        while env._flat is None:
+            if name in env.delta:
+                return env.delta[name]
+            env = env.parent
+        return env._flat[name]
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.flat())
+
+    def __len__(self):
+        return len(self.flat())
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Env):
+            return NotImplemented
+        if (self.parent is not None and self.parent is other.parent
+                and (self.delta is other.delta or self.delta == other.delta)):
+            return True
+        return self.flat() == other.flat()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Env({!r})".format(self.flat())
+
+
+EMPTY = Env()
+
+
+def _chain(env):
+    """`env` and its ancestors, nearest first."""
+    chain = [env]
+    while env.parent is not None:
+        env = env.parent
+        chain.append(env)
+    return chain
+
+
+def changed_names(envs):
+    """The names whose bindings can differ between some of `envs`: the
+    ones bound in the overlays above their deepest common ancestor.
+    Envs with no common ancestor can differ anywhere, so then it is
+    every name any of them binds.
+    """
+    chains = [_chain(env) for env in envs]
+    shared = set(map(id, chains[0]))
+    for chain in chains[1:]:
+        shared.intersection_update(map(id, chain))
+    names = set()
+    for chain in chains:
+        for env in chain:
+            if id(env) in shared:
+                break
+            names.update(env.delta)
+        else:
+            # No common ancestor: the base differs too.
+            names.update(chain[-1].delta)
+    return names
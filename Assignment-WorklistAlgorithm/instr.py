@@ -0,0 +1,158 @@
+"""Compact instructions.
+
+As JSON, every instruction is a dict that repeats its keys ("op",
+"dest", "args", ...) and holds its own copies of the variable and
+opcode names, and its operands are lists. An `Instr` keeps the standard
+members in slots, interns every opcode, variable, function and label
+name (so each distinct name is stored once), and keeps operands in
+tuples. Members it has no slot for (`pos`, for instance) go into a small
+dict of extras.
+
+An `Instr` also reads like the dict it was made from: `instr["op"]`,
+`"dest" in instr`, `instr.get("args", [])` and assigning members all
+work, so form_blocks, both CFG modules and the data flow analyses take
+either form. `to_json` gives back the dict, with the same members and
+values.
+
+`json_hook` makes the parsers build `Instr`s directly:
+
+    json.load(fp, object_hook=json_hook)
+"""
+
+import sys
+
+# Members that hold a name and are interned.
+NAMES = ("label", "op", "dest")
+# Members that hold a list of names, kept as a tuple.
+OPERANDS = ("args", "funcs", "labels")
+FIELDS = NAMES + ("type", "value") + OPERANDS
+
+_FIELDS = frozenset(FIELDS)
+_intern = sys.intern
+
+
+def _convert(key, val):
+    if val is None:
+        return None
+    if key in NAMES:
+        return _intern(val) if isinstance(val, str) else val
+    if key in OPERANDS:
+        return tuple(_intern(v) if isinstance(v, str) else v for v in val)
+    if key == "type" and isinstance(val, str):
+        return _intern(val)
+    return val
+
+
+class Instr:
+    """One instruction or label. A member that is not there is None."""
+
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, members=()):
+        if not isinstance(members, dict):
+            members = dict(members)
+        get = members.get
+        self.label = _convert("label", get("label"))
+        self.op = _convert("op", get("op"))
+        self.dest = _convert("dest", get("dest"))
+        self.type = _convert("type", get("type"))
+        self.value = get("value")
+        args = get("args")
+        self.args = None if args is None else tuple(map(_intern, args))
+        self.funcs = _convert("funcs", get("funcs"))
+        self.labels = _convert("labels", get("labels"))
+        self.extra = None
+        if not _FIELDS.issuperset(members):
+            self.extra = {key: val for key, val in members.items() if key not in _FIELDS}
+
+    @classmethod
+    def from_json(cls, obj):
+        return obj if isinstance(obj, cls) else cls(obj)
+
+    def to_json(self):
+        """The instruction as a JSON dict. Operands become lists again."""
+        obj = {}
+        for key in FIELDS:
+            val = getattr(self, key)
+            if val is not None:
+                obj[key] = list(val) if key in OPERANDS else val
+        if self.extra:
+            obj.update(self.extra)
+        return obj
+
+    # The dict interface.
+
+    def __getitem__(self, key):
+        val = getattr(self, key) if key in _FIELDS else (self.extra or {}).get(key)
+        if val is None:
+            raise KeyError(key)
+        return val
+
+    def get(self, key, default=None):
+        val = getattr(self, key) if key in _FIELDS else (self.extra or {}).get(key)
+        return default if val is None else val
+
+    def __contains__(self, key):
+        if key in _FIELDS:
+            return getattr(self, key) is not None
+        return bool(self.extra) and key in self.extra
+
+    def __setitem__(self, key, val):
+        if key in _FIELDS:
+            setattr(self, key, _convert(key, val))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = val
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in _FIELDS:
+            setattr(self, key, None)
+        else:
+            del self.extra[key]
+
+    def keys(self):
+        return [key for key in FIELDS if getattr(self, key) is not None] + list(self.extra or ())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def copy(self):
+        return Instr(self.items())
+
+    def __repr__(self):
+        return "Instr({!r})".format(self.to_json())
+
+
+def json_hook(obj):
+    """A `json` object hook that turns instructions and labels into
+    `Instr`s and leaves every other object alone.
+    """
+    if "op" in obj or "label" in obj:
+        return Instr(obj)
+    return obj
+
+
+def compact(instrs):
+    """An instruction list with every instruction as an `Instr`."""
+    return [Instr.from_json(instr) for instr in instrs]
+
+
+def to_json(instrs):
+    """An instruction list with every instruction as a JSON dict."""
+    return [instr.to_json() if isinstance(instr, Instr) else instr for instr in instrs]
+
+
+def json_default(obj):
+    """A `json.dumps` default that writes `Instr`s as their dicts."""
+    if isinstance(obj, Instr):
+        return obj.to_json()
+    raise TypeError("{!r} is not JSON serializable".format(obj))
@@ -0,0 +1,180 @@
+"""Call graphs and bottom-up function summaries.
+
+On its own, every analysis in df.py has to assume the worst about a
+`call`: all its arguments are read, and its result could be anything.
+A summary records what a function actually does at its boundary:
+
+- live_args: the positions of the arguments it can read,
+- returns: the constant it always returns, "?" if it is not always the
+  same constant, or None if it returns nothing,
+- pure: whether it stays away from memory and output, counting the
+  functions it calls.
+
+Summaries are computed bottom-up over the strongly connected components
+of the call graph, so the summaries of a function's callees are ready
+when it is analyzed. Inside a component (a set of mutually recursive
+functions) live arguments and purity start optimistic (nothing read,
+pure) and are iterated to a fixed point; return values of calls within
+the component count as unknown. Components whose callees are all done
+do not depend on each other, so they are summarized in parallel.
+
+`df.py --interproc` uses the summaries at call sites for `live` and
+`cprop`. Printing them:
+
+    bril2json < prog.bril | python3 interproc.py
+"""
+
+import argparse
+import sys
+from collections import namedtuple
+
+import brilbin
+import cfg
+import df
+import parallel
+from worklist import strongly_connected_components
+
+Summary = namedtuple("Summary", ["live_args", "returns", "pure"])
+
+# What is assumed of a function before (or without) analyzing it.
+UNKNOWN = Summary(live_args=None, returns="?", pure=False)
+
+# Operations that touch memory or the outside world.
+EFFECTS = {"print", "alloc", "free", "load", "store", "speculate", "commit", "guard"}
+
+
+def callees(func):
+    """The names of the functions `func` calls, in order of first call."""
+    names = {}
+    for instr in func["instrs"]:
+        if instr.get("op") == "call":
+            names.setdefault(instr["funcs"][0], None)
+    return list(names)
+
+
+def call_graph(functions):
+    """Map the name of every function to the functions of the program
+    it calls. Calls to functions the program does not define are left
+    out.
+    """
+    defined = {func["name"] for func in functions}
+    return {func["name"]: [name for name in callees(func) if name in defined]
+            for func in functions}
+
+
+def bottom_up_levels(graph):
+    """Group the strongly connected components of a call graph into
+    levels. Every component comes after the components it calls, and
+    the components of one level do not call each other.
+    """
+    level = {}
+    levels = []
+    # Tarjan's algorithm finishes a component after everything it calls.
+    for component in strongly_connected_components(graph, graph):
+        members = set(component)
+        below = [level[callee] for name in component for callee in graph[name]
+                 if callee not in members]
+        depth = max(below, default=-1) + 1
+        for name in component:
+            level[name] = depth
+        if depth == len(levels):
+            levels.append([])
+        levels[depth].append(component)
+    return levels
+
+
+def summarize_function(func, summaries):
+    """Summarize one function, given the summaries of its callees."""
+    blocks = df.function_blocks(func)
+    if blocks:
+        # Parameters are unknown on entry, which has to come before any
+        # loop back to the first block.
+        cfg.add_entry(blocks)
+        cfg.add_terminators(blocks)
+    params = [arg["name"] for arg in func.get("args", [])]
+    pure = True
+    for instr in func["instrs"]:
+        op = instr.get("op")
+        if op in EFFECTS or (op == "call" and not summaries.get(instr["funcs"][0], UNKNOWN).pure):
+            pure = False
+    if not blocks:
+        return Summary(live_args=frozenset(), returns=None, pure=pure)
+
+    live_in, _ = df.df_worklist(blocks, df.live_variables(summaries))
+    entry = live_in[next(iter(blocks))]
+    live_args = frozenset(i for i, name in enumerate(params) if name in entry)
+
+    returns = None
+    consts_in, _ = df.df_worklist(blocks, df.constant_propagation(summaries, params))
+    for name, block in blocks.items():
+        vals = dict(consts_in[name].flat())
+        for instr in block:
+            if instr.get("op") == "ret" and instr.get("args"):
+                val = vals.get(instr["args"][0], "?")
+                returns = val if returns in (None, val) else "?"
+            elif "dest" in instr:
+                vals.update(df.const_defs([instr], summaries))
+    return Summary(live_args=live_args, returns=returns, pure=pure)
+
+
+def summarize_component(task):
+    """Summarize a set of mutually recursive functions. `task` holds the
+    functions and the summaries of everything they call outside the
+    set. Returns a dict from function names to summaries.
+    """
+    functions, known = task
+    summaries = dict(known)
+    for func in functions:
+        summaries[func["name"]] = Summary(live_args=frozenset(), returns="?", pure=True)
+    recursive = len(functions) > 1 or functions[0]["name"] in callees(functions[0])
+    changed = True
+    while changed:
+        changed = False
+        for func in functions:
+            summary = summarize_function(func, summaries)
+            if recursive:
+                # What a recursive call returns is not known yet.
+                summary = summary._replace(returns="?")
+            if summary != summaries[func["name"]]:
+                summaries[func["name"]] = summary
+                changed = True
+    return {func["name"]: summaries[func["name"]] for func in functions}
+
+
+def summarize(functions, jobs=1):
+    """Summarize every function of a program, with the components of
+    each level of the call graph spread over `jobs` worker processes.
+    """
+    by_name = {func["name"]: func for func in functions}
+    graph = call_graph(functions)
+    summaries = {}
+    with parallel.pool_map(jobs) as map_:
+        for level in bottom_up_levels(graph):
+            tasks = []
+            for component in level:
+                needed = {callee for name in component for callee in graph[name]}
+                tasks.append(([by_name[name] for name in component],
+                              {name: summaries[name] for name in needed if name in summaries}))
+            for result in map_(summarize_component, tasks):
+                summaries.update(result)
+    return summaries
+
+
+def fmt_summary(name, summary):
+    live = ", ".join(str(i) for i in sorted(summary.live_args)) or "∅"
+    returns = "none" if summary.returns is None else summary.returns
+    return "{}:\n  live args: {}\n  returns: {}\n  pure: {}\n".format(
+        name, live, str(returns).lower() if isinstance(returns, bool) else returns,
+        "yes" if summary.pure else "no")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the interprocedural summary of every function in a Bril program read from stdin.")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="summarize independent functions in N worker processes")
+    args = parser.parse_args()
+
+    prog = brilbin.load_program(sys.stdin)
+    summaries = summarize(prog["functions"], args.jobs)
+    for func in prog["functions"]:
+        sys.stdout.write(fmt_summary(func["name"], summaries[func["name"]]))
@@ -0,0 +1,134 @@
+"""Read and write Bril programs one function at a time.
+
+`json.load` parses a whole program before anything else can happen, so
+peak memory is several times the size of the input. `iter_functions`
+instead parses the `functions` array element by element, so only one
+function (plus a read buffer) is in memory at once. `ProgramWriter`
+writes functions as they are produced, in exactly the format of
+`json.dumps(program, indent=2)`.
+"""
+
+import json
+
+WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    """A text buffer over a file that is refilled on demand."""
+
+    def __init__(self, fp, chunk_size, object_hook=None):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder(object_hook=object_hook)
+
+    def fill(self):
+        # Read at least as much as is still buffered, so a value that
+        # spans many chunks is decoded a logarithmic number of times.
+        chunk = self.fp.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Skip whitespace and return the next character ("" at EOF)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("expected {!r} at offset {} of the JSON input".format(char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            # A number at the end of the buffer may continue in the
+            # next chunk.
+            if end == len(self.buf) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return val
+
+
+def iter_functions(fp, extras=None, chunk_size=1 << 16, object_hook=None):
+    """Yield the functions of the Bril program read from `fp`, one at a
+    time, as they are parsed.
+
+    Top-level members other than `functions` are stored into the
+    `extras` dict, if one is given. Members that follow the `functions`
+    array are only there once the generator is exhausted. `object_hook`
+    works like in `json.load`.
+    """
+    reader = _Reader(fp, chunk_size, object_hook)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == "functions":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.peek() == ",":
+                        reader.pos += 1
+                    else:
+                        reader.expect("]")
+                        break
+        else:
+            val = reader.value()
+            if extras is not None:
+                extras[key] = val
+        if reader.peek() == ",":
+            reader.pos += 1
+        else:
+            reader.expect("}")
+            return
+
+
+def _indent(text, prefix):
+    return text.replace("\n", "\n" + prefix)
+
+
+class ProgramWriter:
+    """Write a Bril program to `fp` one function at a time.
+
+    The output is byte-for-byte what `json.dumps(program, indent=2)`
+    prints for a program whose first member is `functions`.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+
+    def write_function(self, func):
+        self.fp.write('{\n  "functions": [\n    ' if self.count == 0 else ",\n    ")
+        self.fp.write(_indent(json.dumps(func, indent=2), "    "))
+        self.count += 1
+
+    def close(self, extras=None):
+        """Finish the `functions` array and write the other members."""
+        self.fp.write('{\n  "functions": []' if self.count == 0 else "\n  ]")
+        for key, val in (extras or {}).items():
+            self.fp.write(",\n  {}: {}".format(json.dumps(key), _indent(json.dumps(val, indent=2), "  ")))
+        self.fp.write("\n}\n")
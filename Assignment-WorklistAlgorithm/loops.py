@@ -0,0 +1,285 @@
+"""Natural loops and loop-invariant code motion.
+
+An edge whose target dominates its source is a back edge, and its
+natural loop is the target (the header) plus every block that reaches
+the source without going through the header. Loops that share a header
+are one loop. Any two natural loops are either disjoint or nested, so
+they form a forest: each loop's parent is the smallest loop around it.
+
+`insert_preheaders` gives every loop a block of its own that runs right
+before the header is entered from outside, and `hoist` moves invariant
+computations there. An instruction is invariant if it is pure arithmetic
+(or a constant or a copy) whose operands are not written anywhere in
+the loop, counting as not written the operands whose definitions were
+already hoisted. It can be hoisted when
+
+- it is the only definition of its destination in the loop,
+- its destination is not live on entry to the header, so every use in
+  the loop reads this definition, and
+- its block dominates every exit of the loop, or its destination is dead
+  wherever the loop exits to.
+
+Hoisting also runs the instruction when the loop body does not, which
+is why operations that can fail (integer division) are never hoisted.
+Inner loops go first, so a computation can move out of several loops.
+
+    bril2json < prog.bril | python3 loops.py | bril2txt
+    bril2json < prog.bril | python3 loops.py --forest
+"""
+
+import argparse
+import json
+import sys
+
+import cfg
+import df
+import ssa
+from lvn import PURE
+from util import fresh
+
+# Instructions that can run more often than the program asks for
+# without changing what it does.
+HOISTABLE = (PURE - {"div"}) | {"const", "id"}
+
+
+class Loop:
+    """A natural loop: its header, the names of all its blocks (the
+    header included), the blocks its back edges come from and its place
+    in the loop forest.
+    """
+
+    __slots__ = ("header", "body", "latches", "parent", "children", "preheader")
+
+    def __init__(self, header, body, latches):
+        self.header = header
+        self.body = body
+        self.latches = latches
+        self.parent = None
+        self.children = []
+        self.preheader = None
+
+    @property
+    def depth(self):
+        depth = 1
+        loop = self.parent
+        while loop is not None:
+            depth += 1
+            loop = loop.parent
+        return depth
+
+    def exits(self, succs):
+        """(inside, outside) for every edge that leaves the loop."""
+        return [(name, succ) for name in self.body for succ in succs[name]
+                if succ not in self.body]
+
+
+def dominates(idom, a, b):
+    """Whether block `a` dominates block `b`."""
+    while b != a:
+        if idom[b] == b:
+            return False
+        b = idom[b]
+    return True
+
+
+def natural_loops(blocks, idom=None):
+    """The natural loops of a block map whose blocks all have
+    terminators and are reachable from the entry, outermost first.
+    """
+    if idom is None:
+        idom, _ = ssa.dominator_tree(blocks)
+    preds, succs = cfg.edges(blocks)
+    latches = {}
+    for name in blocks:
+        for succ in succs[name]:
+            if dominates(idom, succ, name):
+                latches.setdefault(succ, []).append(name)
+
+    loops = []
+    for header, sources in latches.items():
+        body = {header}
+        work = [source for source in sources if source != header]
+        while work:
+            name = work.pop()
+            if name not in body:
+                body.add(name)
+                work += preds[name]
+        loops.append(Loop(header, body, sources))
+    loops.sort(key=lambda loop: len(loop.body), reverse=True)
+    return loops
+
+
+def loop_forest(loops):
+    """Link `loops` (outermost first, as `natural_loops` returns them)
+    into a forest, and return its roots.
+    """
+    roots = []
+    for i, loop in enumerate(loops):
+        # The smallest earlier loop that holds this header holds all of
+        # this loop.
+        for outer in reversed(loops[:i]):
+            if loop.header in outer.body:
+                loop.parent = outer
+                outer.children.append(loop)
+                break
+        else:
+            roots.append(loop)
+    return roots
+
+
+def insert_preheaders(blocks, loops):
+    """Give every loop a new, empty block that jumps to the header, and
+    send the edges that enter the loop from outside through it. The new
+    blocks go into `blocks` right before their headers, and into the
+    bodies of the loops around them.
+    """
+    preds, _ = cfg.edges(blocks)
+    placed = {}
+    for loop in loops:
+        name = loop.header + ".preheader"
+        if name in blocks or name in placed.values():
+            name = fresh(name + ".", blocks.keys() | set(placed.values()))
+        loop.preheader = name
+        placed[loop.header] = name
+        for pred in preds[loop.header]:
+            if pred not in loop.body:
+                term = blocks[pred][-1]
+                term["labels"] = [name if label == loop.header else label for label in term["labels"]]
+                blocks[pred].invalidate()
+        outer = loop.parent
+        while outer is not None:
+            outer.body.add(name)
+            outer = outer.parent
+
+    items = list(blocks.items())
+    blocks.clear()
+    for name, block in items:
+        if name in placed:
+            blocks[placed[name]] = cfg.Block([{"op": "jmp", "labels": [name]}])
+        blocks[name] = block
+
+
+def hoist(blocks, loops):
+    """Move the invariant instructions of every loop into its preheader,
+    innermost loops first. `insert_preheaders` has to have run. Returns
+    the number of instructions moved.
+    """
+    idom, _ = ssa.dominator_tree(blocks)
+    _, succs = cfg.edges(blocks)
+    live = df.ANALYSES["live"]
+    live_in, live_out = df.df_worklist(blocks, live)
+    position = {name: i for i, name in enumerate(blocks)}
+    moved = 0
+    for loop in sorted(loops, key=lambda loop: loop.depth, reverse=True):
+        # How often each variable is written in the loop.
+        writes = {}
+        for name in loop.body:
+            for instr in blocks[name]:
+                if "dest" in instr:
+                    writes[instr["dest"]] = writes.get(instr["dest"], 0) + 1
+
+        exits = loop.exits(succs)
+        # Variables read after the loop exits.
+        leaving = set()
+        for _, outside in exits:
+            leaving |= live_in[outside]
+
+        hoisted = []
+        changed = True
+        while changed:
+            changed = False
+            for name in sorted(loop.body, key=position.get):
+                block = blocks[name]
+                for instr in list(block):
+                    dest = instr.get("dest")
+                    if (dest is None or instr.get("op") not in HOISTABLE
+                            or writes.get(dest) != 1 or dest in live_in[loop.header]
+                            or any(writes.get(arg) for arg in instr.get("args", []))):
+                        continue
+                    if dest in leaving and not all(dominates(idom, name, inside) for inside, _ in exits):
+                        continue
+                    block.remove(instr)
+                    hoisted.append(instr)
+                    writes[dest] = 0
+                    changed = True
+
+        if hoisted:
+            pre = blocks[loop.preheader]
+            pre[-1:-1] = hoisted
+            moved += len(hoisted)
+            live_in, live_out = df.df_incremental(blocks, live, (live_in, live_out),
+                                                  loop.body | {loop.preheader})
+    return moved
+
+
+def optimize(func):
+    """Return the instructions of a function after loop-invariant code
+    motion.
+    """
+    blocks = df.function_blocks(func)
+    if not blocks:
+        return list(func["instrs"])
+    optimize_blocks(blocks)
+    return cfg.reassemble(blocks, elide_jumps=True)
+
+
+def optimize_blocks(blocks):
+    """Loop-invariant code motion on a block map whose blocks end in
+    terminators, in place. Hoisting moves instructions, so the caller's
+    instruction objects are copied first.
+    """
+    if not blocks:
+        return
+    for block in blocks.values():
+        block[:] = [dict(instr) for instr in block]
+    ssa.normalize(blocks)
+    loops = natural_loops(blocks)
+    loop_forest(loops)
+    insert_preheaders(blocks, loops)
+    hoist(blocks, loops)
+    # Preheaders that got nothing are only in the way.
+    preds, _ = cfg.edges(blocks)
+    for loop in loops:
+        if len(blocks[loop.preheader]) == 1:
+            for pred in preds[loop.preheader]:
+                term = blocks[pred][-1]
+                term["labels"] = [loop.header if label == loop.preheader else label
+                                  for label in term["labels"]]
+            del blocks[loop.preheader]
+
+
+def forest_report(func):
+    """The loop forest of a function, one loop per line, indented by
+    depth.
+    """
+    lines = ["{}:".format(func["name"])]
+    blocks = ssa.prepare([dict(instr) for instr in func["instrs"]])
+    if blocks:
+        order = list(blocks)
+
+        def show(loop, indent):
+            lines.append("{}{}: {}".format(
+                "  " * indent, loop.header,
+                " ".join(name for name in order if name in loop.body)))
+            for child in sorted(loop.children, key=lambda loop: order.index(loop.header)):
+                show(child, indent + 1)
+
+        for root in sorted(loop_forest(natural_loops(blocks)), key=lambda loop: order.index(loop.header)):
+            show(root, 1)
+    return "".join(line + "\n" for line in lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loop-invariant code motion for a Bril program read from stdin.")
+    parser.add_argument("--forest", action="store_true",
+                        help="print the loop forest of each function instead")
+    args = parser.parse_args()
+
+    prog = json.load(sys.stdin)
+    for func in prog["functions"]:
+        if args.forest:
+            sys.stdout.write(forest_report(func))
+        else:
+            func["instrs"] = optimize(func)
+    if not args.forest:
+        print(json.dumps(prog, indent=2))
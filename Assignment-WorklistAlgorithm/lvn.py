@@ -0,0 +1,282 @@
+"""Local and global value numbering.
+
+Local value numbering walks each block once, giving every computed value
+a number. An instruction that computes a value some variable already
+holds becomes a copy of that variable, operands are replaced by the
+variable that first held their value (so the copies themselves tend to
+become dead), operations on constants are folded, and the operands of
+commutative operations are put in a canonical order.
+
+The global pass starts each block's table with what holds on entry
+according to `available_values`, an extension of the available
+expressions analysis in df.py: its facts also name the variable holding
+each expression, and it tracks copies and constants too. A fact only
+reaches a block if it holds on every path into it, so it comes from
+computations that dominate the block.
+
+Deleting the copies that end up unused is left to dead code elimination:
+    bril2json < prog.bril | python3 lvn.py | python3 ../Exercises/tdce.py
+"""
+
+import argparse
+import json
+import sys
+
+import cfg
+import df
+from form_blocks import form_blocks
+from sccp import FOLD, BOTTOM
+
+COMMUTATIVE = {"add", "mul", "eq", "and", "or", "fadd", "fmul", "feq"}
+
+# Operations whose result depends only on their operands. Anything else
+# with a destination (call, load, alloc, phi, ...) always gets a new
+# value number.
+PURE = (set(FOLD) - {"id"}) | {"fadd", "fsub", "fmul", "fdiv", "feq", "flt", "fgt", "fle", "fge"}
+
+
+def canonical_args(op, args, key=None):
+    return sorted(args, key=key) if op in COMMUTATIVE else list(args)
+
+
+class Numbering:
+    """The value table of one block."""
+
+    def __init__(self):
+        self.count = 0
+        self.var_value = {}  # Variable -> number of the value it holds now.
+        self.holders = {}    # Number -> variables that have held it, oldest first.
+        self.exprs = {}      # Expression key -> number.
+        self.consts = {}     # Number -> Python value, for constants.
+
+    def new_value(self):
+        self.count += 1
+        return self.count
+
+    def value_of(self, var):
+        """The number of `var`'s value (a new one if nothing is known)."""
+        num = self.var_value.get(var)
+        if num is None:
+            num = self.assign(var, self.new_value())
+        return num
+
+    def home(self, num):
+        """The oldest variable that still holds value `num`, or None."""
+        for var in self.holders.get(num, ()):
+            if self.var_value.get(var) == num:
+                return var
+        return None
+
+    def assign(self, var, num):
+        self.var_value[var] = num
+        self.holders.setdefault(num, []).append(var)
+        return num
+
+    def constant(self, typ, value):
+        """The number of a constant, shared by every variable holding it."""
+        key = ("const", typ, value)
+        num = self.exprs.get(key)
+        if num is None:
+            num = self.exprs[key] = self.new_value()
+            self.consts[num] = value
+        return num
+
+    def key(self, op, arg_values):
+        if op in COMMUTATIVE:
+            arg_values = sorted(arg_values)
+        return (op,) + tuple(arg_values)
+
+
+def seed(numbering, facts):
+    """Enter the facts `available_values` found at a block's entry. A
+    fact whose operands are held by other facts goes after those, so
+    the numbers line up.
+    """
+    homes = {fact[-1] for fact in facts}
+    pending = sorted(facts, key=repr)
+    while pending:
+        ready = [fact for fact in pending
+                 if not any(arg in homes for arg in fact_args(fact))]
+        if not ready:  # Cannot happen for a consistent solution.
+            ready = pending
+        for fact in ready:
+            homes.discard(fact[-1])
+            dest = fact[-1]
+            if dest in numbering.var_value:
+                continue
+            if fact[0] == "const":
+                numbering.assign(dest, numbering.constant(fact[1], fact[2]))
+            elif fact[0] == "copy":
+                numbering.assign(dest, numbering.value_of(fact[1]))
+            else:
+                key = numbering.key(fact[1], [numbering.value_of(arg) for arg in fact[2]])
+                num = numbering.exprs.get(key)
+                if num is None:
+                    num = numbering.exprs[key] = numbering.new_value()
+                numbering.assign(dest, num)
+        ready = set(ready)
+        pending = [fact for fact in pending if fact not in ready]
+
+
+def fact_args(fact):
+    if fact[0] == "copy":
+        return (fact[1],)
+    if fact[0] == "expr":
+        return fact[2]
+    return ()
+
+
+def number_block(block, facts=()):
+    """Value-number one block, in place, starting from `facts`."""
+    numbering = Numbering()
+    seed(numbering, facts)
+    out = []
+    for instr in block:
+        op = instr.get("op")
+        if "args" in instr and op != "phi":
+            values = [numbering.value_of(arg) for arg in instr["args"]]
+            args = [numbering.home(num) or arg for num, arg in zip(values, instr["args"])]
+            instr = dict(instr, args=canonical_args(op, args, key=numbering.value_of))
+        if "dest" not in instr:
+            out.append(instr)
+            continue
+
+        dest = instr["dest"]
+        if op == "const":
+            num = numbering.constant(instr["type"], instr["value"])
+        elif op == "id" and "args" in instr:
+            num = numbering.value_of(instr["args"][0])
+        elif op in PURE:
+            values = [numbering.value_of(arg) for arg in instr["args"]]
+            if op in FOLD and all(num in numbering.consts for num in values):
+                value = FOLD[op](*(numbering.consts[num] for num in values))
+                if value != BOTTOM:
+                    instr = {"op": "const", "dest": dest, "type": instr["type"], "value": value}
+                    num = numbering.constant(instr["type"], value)
+            if instr["op"] != "const":
+                key = numbering.key(op, values)
+                num = numbering.exprs.get(key)
+                holder = num is not None and numbering.home(num)
+                if holder:
+                    instr = {"op": "id", "dest": dest, "type": instr["type"], "args": [holder]}
+                elif num is None:
+                    num = numbering.exprs[key] = numbering.new_value()
+        else:
+            num = numbering.new_value()
+            numbering.assign(dest, num)
+            out.append(instr)
+            continue
+        # An instruction that gives `dest` the value it already holds
+        # can go.
+        if numbering.var_value.get(dest) != num:
+            numbering.assign(dest, num)
+            out.append(instr)
+    block[:] = out
+
+
+def value_facts(block):
+    """The facts that hold at the end of a block, counting only what the
+    block itself computed: ("expr", op, args, dest), ("copy", src, dest)
+    and ("const", type, value, dest). Each one says that `dest` holds
+    that value.
+    """
+    facts = {}  # Variable -> the fact about the value it holds.
+    users = {}  # Variable -> variables whose fact may use it.
+    for instr in block:
+        if "dest" not in instr:
+            continue
+        dest = instr["dest"]
+        # Writing `dest` kills its own fact and those that use it.
+        facts.pop(dest, None)
+        for user in users.pop(dest, ()):
+            if user in facts and dest in fact_args(facts[user]):
+                del facts[user]
+
+        op = instr.get("op")
+        if op == "const":
+            fact = ("const", instr["type"], instr["value"], dest)
+        elif op == "id" and instr["args"][0] != dest:
+            fact = ("copy", instr["args"][0], dest)
+        elif op in PURE and dest not in instr["args"]:
+            fact = ("expr", op, tuple(canonical_args(op, instr["args"])), dest)
+        else:
+            continue
+        facts[dest] = fact
+        for arg in fact_args(fact):
+            users.setdefault(arg, set()).add(dest)
+    return set(facts.values())
+
+
+def written(block):
+    return {instr["dest"] for instr in block if "dest" in instr}
+
+
+def available_values(blocks):
+    """Which values are held by which variables on entry to each block,
+    on every path. Like available expressions, a fact dies when one of
+    its operands is written, and also when the variable holding the
+    value is.
+    """
+    universe = set()
+    for block in blocks.values():
+        universe |= cfg.summary(block, value_facts)
+
+    def transfer(block, in_vals, _=None):
+        defined = cfg.summary(block, written)
+        kept = {fact for fact in in_vals
+                if fact[-1] not in defined and defined.isdisjoint(fact_args(fact))}
+        return kept | cfg.summary(block, value_facts)
+
+    def merge(sets):
+        sets = list(sets)
+        if not sets:  # The entry block: nothing is known yet.
+            return set()
+        result = set(sets[0])
+        for s in sets[1:]:
+            result &= s
+        return result
+
+    return df.Analysis(True, init=universe, merge=merge, transfer=transfer,
+                       incremental=False)
+
+
+def optimize(instrs, global_=True):
+    """Return the instructions of a function after value numbering."""
+    blocks = cfg.block_map(form_blocks(instrs))
+    if not blocks:
+        return list(instrs)
+    cfg.add_entry(blocks)
+    cfg.add_terminators(blocks)
+    optimize_blocks(blocks, global_)
+    return cfg.reassemble(blocks, elide_jumps=True)
+
+
+def optimize_blocks(blocks, global_=True):
+    """Value-number a block map whose blocks end in terminators, in
+    place. The global pass needs an entry block without predecessors
+    and adds one if there is none; the local one keeps the blocks as
+    they are.
+    """
+    if not blocks:
+        return
+    if global_:
+        cfg.add_entry(blocks)
+        cfg.add_terminators(blocks)
+    for block in blocks.values():
+        number_block(block)
+    if global_:
+        in_, _ = df.df_worklist(blocks, available_values(blocks))
+        for name, block in blocks.items():
+            number_block(block, in_[name])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Value numbering for a Bril program read from stdin.")
+    parser.add_argument("--local", action="store_true",
+                        help="only number values within each block")
+    args = parser.parse_args()
+
+    prog = json.load(sys.stdin)
+    for func in prog["functions"]:
+        func["instrs"] = optimize(func["instrs"], global_=not args.local)
+    print(json.dumps(prog, indent=2))
@@ -0,0 +1,62 @@
+"""Run a per-function job over a pool of worker processes.
+
+The functions of a Bril program are independent of each other for the
+CFG and data flow tools, so each one can be handled in its own process.
+"""
+
+import collections
+import contextlib
+import itertools
+import multiprocessing
+
+
+def _run(task):
+    worker, funcs = task
+    return [worker(func) for func in funcs]
+
+
+def map_functions(worker, functions, jobs=1, chunksize=8):
+    """Yield `worker(func)` for each function, in the original order.
+
+    With `jobs` > 1 the functions are spread over that many worker
+    processes in chunks of `chunksize`, and each one is sent the whole
+    function (its name, arguments, type and instructions). `worker` has
+    to be picklable: a module-level function or a `functools.partial`
+    of one.
+
+    `functions` is read lazily: at most two chunks per worker are taken
+    from it before their results have been yielded, so streaming input
+    stays bounded in memory.
+    """
+    if jobs <= 1:
+        for func in functions:
+            yield worker(func)
+        return
+
+    functions = iter(functions)
+    pending = collections.deque()
+    exhausted = False
+    with multiprocessing.Pool(jobs) as pool:
+        while True:
+            while not exhausted and len(pending) < 2 * jobs:
+                chunk = list(itertools.islice(functions, chunksize))
+                if chunk:
+                    pending.append(pool.apply_async(_run, ((worker, chunk),)))
+                else:
+                    exhausted = True
+            if not pending:
+                return
+            yield from pending.popleft().get()
+
+
+@contextlib.contextmanager
+def pool_map(jobs=1):
+    """A `map` over `jobs` worker processes that stays open for the whole
+    `with` block, for work that comes in rounds. With `jobs` <= 1 it is
+    the builtin `map`.
+    """
+    if jobs <= 1:
+        yield map
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        yield pool.imap
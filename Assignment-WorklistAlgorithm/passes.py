@@ -0,0 +1,231 @@
+"""Run a pipeline of passes and analyses over a Bril program in one process.
+
+Chaining the separate tools with pipes re-parses the JSON and rebuilds
+the blocks at every stage. Here the program is loaded once, and each
+function goes through the whole pipeline in memory:
+
+    bril2json < prog.bril | python3 passes.py dce,df:live,cfg:rpo
+
+Transform passes rewrite the function's block map in place, and its
+instructions are only put back together when a later step or the output
+needs them. Analyses print the same report as the matching df.py or
+mycfg.py mode. Whatever an analysis builds (the CFG and its traversals,
+data flow and CFG reports) is kept with the function and reused by later
+steps. A transform declares which of those it preserves; everything else
+is dropped when it runs.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import sys
+from collections import namedtuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "Assignment-WorkingWithCFGs"))
+sys.path.insert(0, os.path.join(ROOT, "Exercises"))
+sys.path.insert(0, os.path.join(ROOT, "Assignment-DeadStoreElim"))
+
+import brilbin
+import cfg
+import df
+import dse
+import loops
+import lvn
+import mycfg
+import parallel
+import sccp
+import tdce
+
+# Names for the mycfg.py modes.
+CFG_MODES = {
+    "dot": "-c",
+    "paths": "-l",
+    "all-paths": "-L",
+    "rpo": "-p",
+    "back": "-b",
+    "reducible": "-r",
+}
+
+# The results that only depend on the blocks and their edges: the CFG
+# of mycfg.py and the reports of its modes.
+CFG_RESULTS = frozenset(["cfg"] + ["cfg" + mode for mode in CFG_MODES.values()])
+
+# A transform pass:
+# - run: Take the function and its block map (with a terminator at the
+#   end of every block, see `df.function_blocks`) and change the blocks
+#   in place.
+# - preserves: The analyses (keys of `Unit.results`) that are still
+#   valid afterwards.
+Transform = namedtuple("Transform", ["run", "preserves"])
+
+TRANSFORMS = {
+    # Dead code elimination and local value numbering keep every block
+    # and its terminator's labels, so only the contents change.
+    "dce": Transform(lambda func, blocks: tdce.eliminate_blocks(blocks), preserves=CFG_RESULTS),
+    "lvn": Transform(lambda func, blocks: lvn.optimize_blocks(blocks), preserves=frozenset()),
+    "lvn-local": Transform(lambda func, blocks: lvn.optimize_blocks(blocks, global_=False),
+                           preserves=CFG_RESULTS),
+    "sccp": Transform(sccp.optimize_blocks, preserves=frozenset()),
+    "dse": Transform(dse.optimize_blocks, preserves=frozenset()),
+    "licm": Transform(lambda func, blocks: loops.optimize_blocks(blocks), preserves=frozenset()),
+}
+
+
+class Unit:
+    """One function going through the pipeline: its block map, which the
+    transforms change, and the results of the analyses computed for it
+    so far. With `trace`, every result that is computed or reused is
+    listed on stderr.
+    """
+
+    def __init__(self, func, trace=False):
+        self.func = func
+        self.results = {}
+        self.trace = trace
+        self._blocks = None
+        self._made_up = set()  # Names of blocks that had no label.
+        self._stale = False    # Whether func["instrs"] lags behind the blocks.
+
+    def log(self, what, name):
+        if self.trace:
+            print("{}: {} {}".format(self.func.get("name"), what, name), file=sys.stderr)
+
+    def get(self, name, compute):
+        """The result called `name`, computed by `compute(self)` if it is
+        not there yet.
+        """
+        if name in self.results:
+            self.log("reused", name)
+        else:
+            self.log("computed", name)
+            self.results[name] = compute(self)
+        return self.results[name]
+
+    def blocks(self):
+        """The block map that the data flow analyses and the transforms
+        share. It is formed once and then only changed in place.
+        """
+        if self._blocks is None:
+            self._blocks = df.function_blocks(self.func)
+            labels = {instr["label"] for instr in self.func["instrs"] if "label" in instr}
+            self._made_up = set(self._blocks) - labels
+        return self._blocks
+
+    def instrs(self):
+        """The function's instructions, put back together from the
+        blocks if a transform changed them. Blocks that had no label
+        still have none, unless something jumps to them now.
+        """
+        if self._stale:
+            instrs = cfg.reassemble(self._blocks, elide_jumps=True)
+            targets = {label for instr in instrs for label in instr.get("labels", ())}
+            self.func["instrs"] = [instr for instr in instrs
+                                   if instr.get("label") not in self._made_up - targets]
+            self._stale = False
+        return self.func["instrs"]
+
+    def cfg(self):
+        """The blocks and CFG of mycfg.py, shared by its modes."""
+        return self.get("cfg", lambda unit: mycfg.build_cfg(dict(unit.func, instrs=unit.instrs())))
+
+    def transform(self, name):
+        step = TRANSFORMS[name]
+        self.log("running", name)
+        step.run(self.func, self.blocks())
+        self._stale = True
+        for result in list(self.results):
+            if result not in step.preserves:
+                del self.results[result]
+
+
+def parse_pipeline(spec):
+    """Check a pipeline such as "dce,df:live,cfg:rpo" and return its
+    steps as (kind, argument) pairs.
+    """
+    steps = []
+    for item in spec.split(","):
+        item = item.strip()
+        kind, _, arg = item.partition(":")
+        if kind == "df" and (arg in df.ANALYSES or arg in ("reaching", "available")):
+            steps.append(("df", arg))
+        elif kind == "cfg" and (arg in CFG_MODES or "-" + arg in CFG_MODES.values()):
+            steps.append(("cfg", CFG_MODES.get(arg, "-" + arg)))
+        elif not arg and kind in TRANSFORMS:
+            steps.append(("pass", kind))
+        else:
+            raise ValueError("unknown pipeline step {!r}".format(item))
+    return steps
+
+
+def run_function(func, steps, dense=False, trace=False):
+    """Run the pipeline over one function. Returns the reports it
+    printed and the function's final instructions.
+    """
+    unit = Unit(func, trace)
+    reports = []
+    for kind, arg in steps:
+        if kind == "pass":
+            unit.transform(arg)
+        elif kind == "df":
+            reports.append(unit.get("df:" + arg, lambda unit: df.df_function(
+                unit.func, arg, dense=dense, blocks=unit.blocks())))
+        else:
+            reports.append(unit.get("cfg" + arg, lambda unit: mycfg.cfg_report(
+                unit.func, arg, unit.cfg())))
+    return "".join(reports), unit.instrs()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a pipeline of passes and analyses over a Bril program read from stdin.")
+    parser.add_argument("pipeline",
+                        help="comma-separated steps: passes ({}), df:ANALYSIS, cfg:MODE ({})".format(
+                            ", ".join(TRANSFORMS), ", ".join(CFG_MODES)))
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write the transformed program to FILE")
+    parser.add_argument("--binary", action="store_true",
+                        help="write the program in the binary format of brilbin.py")
+    parser.add_argument("--dense", action="store_true",
+                        help="use the bit-vector backend for reaching and available")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="run the pipeline over the functions in N worker processes")
+    parser.add_argument("--quiet", action="store_true",
+                        help="do not list the instructions dce deletes on stderr")
+    parser.add_argument("--trace", action="store_true",
+                        help="list on stderr which results each step computes and which it reuses")
+    args = parser.parse_args()
+
+    try:
+        steps = parse_pipeline(args.pipeline)
+    except ValueError as err:
+        parser.error(str(err))
+
+    prog = brilbin.load_program(sys.stdin)
+    worker = functools.partial(run_function, steps=steps, dense=args.dense, trace=args.trace)
+    with contextlib.ExitStack() as stack:
+        if args.quiet:
+            stack.enter_context(contextlib.redirect_stderr(stack.enter_context(open(os.devnull, "w"))))
+        for func, (text, instrs) in zip(prog["functions"],
+                                        parallel.map_functions(worker, prog["functions"], args.jobs)):
+            sys.stdout.write(text)
+            func["instrs"] = instrs
+
+    # Without any analysis to report, the program itself is the output.
+    if args.output:
+        with open(args.output, "wb" if args.binary else "w") as f:
+            if args.binary:
+                brilbin.dump(prog, f)
+            else:
+                json.dump(prog, f, indent=2)
+                f.write("\n")
+    elif all(kind == "pass" for kind, _ in steps):
+        if args.binary:
+            brilbin.dump(prog, sys.stdout.buffer)
+        else:
+            print(json.dumps(prog, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Batched reachability and shortest path lengths over a `cfg.CFG`.
+
+A breadth-first search per source walks the whole graph once for every
+source. Here many sources share one search: every block carries a
+bitset with one bit per source, and a level of the search ORs the
+frontier bits of each block into its successors, so a single pass over
+the edges advances the searches from all sources at once. Bits a block
+has not seen before make up its next frontier, and the level at which a
+source's bit first arrives is the block's distance from that source.
+
+With NumPy installed, the bitsets of the frontier are rows of 64-bit
+words and a level is a handful of array operations over those rows.
+Without it, each bitset is one Python int (`backend="int"` asks for
+that either way). Sources are processed in batches of `BATCH`, which
+bounds the size of the bitsets on very large graphs.
+"""
+
+from itertools import islice
+
+try:
+    import numpy
+except ImportError:  # Fall back to int bitsets.
+    numpy = None
+
+BATCH = 4096
+
+
+def _int_levels(graph, sources):
+    """Yield, for each BFS level, the newly reached (block ID, source
+    index) pairs as two lists, using Python ints as bitsets.
+    """
+    offsets, targets = graph.succ_offsets, graph.succ_targets
+    seen = [0] * len(graph.names)
+    frontier = {}
+    for k, source in enumerate(sources):
+        seen[source] |= 1 << k
+        frontier[source] = frontier.get(source, 0) | 1 << k
+    while frontier:
+        nodes, indices = [], []
+        for node in sorted(frontier):
+            mask = frontier[node]
+            while mask:
+                low = mask & -mask
+                nodes.append(node)
+                indices.append(low.bit_length() - 1)
+                mask ^= low
+        yield nodes, indices
+
+        reached = {}
+        for node, mask in frontier.items():
+            for succ in targets[offsets[node]:offsets[node + 1]]:
+                reached[succ] = reached.get(succ, 0) | mask
+        frontier = {}
+        for node, mask in reached.items():
+            new = mask & ~seen[node]
+            if new:
+                seen[node] |= new
+                frontier[node] = new
+
+
+def _numpy_levels(graph, sources):
+    """Like `_int_levels`, with a row of 64-bit words per block. Only
+    the rows of the current frontier are kept, so a level costs time in
+    proportion to the frontier and its out-edges, not to the graph.
+    """
+    n, width = len(graph.names), (len(sources) + 63) // 64
+    offsets = numpy.frombuffer(graph.succ_offsets, dtype=numpy.intc).astype(numpy.intp)
+    targets = numpy.frombuffer(graph.succ_targets, dtype=numpy.intc).astype(numpy.intp)
+    k = numpy.arange(len(sources))
+    seen = numpy.zeros((n, width), dtype=numpy.uint64)
+    numpy.bitwise_or.at(seen, (numpy.asarray(sources, dtype=numpy.intp), k // 64),
+                        numpy.left_shift(numpy.uint64(1), (k % 64).astype(numpy.uint64)))
+    # The frontier: the blocks with new bits, in order, and their bits.
+    active = numpy.flatnonzero(seen.any(axis=1))
+    frontier = seen[active]
+    while len(active):
+        # Unpack only the words that have bits set.
+        rows, words = numpy.nonzero(frontier)
+        bits = numpy.unpackbits(frontier[rows, words].astype("<u8").view(numpy.uint8).reshape(-1, 8),
+                                axis=1, bitorder="little")
+        hits, offsets_in_word = numpy.nonzero(bits)
+        yield active[rows[hits]].tolist(), (words[hits] * 64 + offsets_in_word).tolist()
+
+        # The out-edges of the active blocks, as (frontier row, target) pairs.
+        counts = offsets[active + 1] - offsets[active]
+        ends = numpy.cumsum(counts)
+        positions = numpy.arange(ends[-1] if len(ends) else 0) - numpy.repeat(ends - counts, counts)
+        succs = targets[numpy.repeat(offsets[active], counts) + positions]
+        if not len(succs):
+            return
+        # OR together the rows arriving at each target.
+        order = numpy.argsort(succs, kind="stable")
+        succs = succs[order]
+        starts = numpy.flatnonzero(numpy.r_[True, succs[1:] != succs[:-1]])
+        reached = numpy.bitwise_or.reduceat(
+            frontier[numpy.repeat(numpy.arange(len(active)), counts)[order]], starts, axis=0)
+        active = succs[starts]
+        reached &= ~seen[active]
+        keep = reached.any(axis=1)
+        active, frontier = active[keep], reached[keep]
+        seen[active] |= frontier
+
+
+BACKENDS = {
+    "int": _int_levels,
+    "numpy": _numpy_levels,
+}
+
+
+def default_backend():
+    return "numpy" if numpy is not None else "int"
+
+
+def batched_path_lengths(graph, sources=None, batch=BATCH, backend=None):
+    """Yield `(source, lengths)` for every source name in `sources`
+    (every block by default), in order. `lengths` maps each block that
+    can be reached from the source to the length of its shortest path,
+    in order of distance and then block order.
+    """
+    levels = BACKENDS[backend or default_backend()]
+    names, ids = graph.names, graph.ids
+    sources = iter(names if sources is None else sources)
+    while True:
+        chunk = list(islice(sources, batch))
+        if not chunk:
+            return
+        lengths = [{} for _ in chunk]
+        for distance, (nodes, indices) in enumerate(levels(graph, [ids[name] for name in chunk])):
+            for node, k in zip(nodes, indices):
+                lengths[k][names[node]] = distance
+        yield from zip(chunk, lengths)
+
+
+def batched_reachable(graph, sources=None, batch=BATCH, backend=None):
+    """Yield `(source, blocks)` with the set of blocks each source can
+    reach (itself included).
+    """
+    for source, lengths in batched_path_lengths(graph, sources, batch, backend):
+        yield source, set(lengths)
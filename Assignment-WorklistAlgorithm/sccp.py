@@ -0,0 +1,248 @@
+"""Sparse conditional constant propagation (Wegman and Zadeck).
+
+The `cprop` analysis in df.py carries a whole environment through every
+block. This pass instead works on SSA form, where every variable has one
+definition: it keeps one lattice value per variable and only re-evaluates
+the instructions that read a variable whose value just changed. It also
+tracks which CFG edges can execute at all, so a branch on a constant
+only makes its taken side reachable, and values flowing in from the
+other side never spoil a phi.
+
+Afterwards, definitions with a constant value become `const`
+instructions, branches on constants become jumps, unreachable blocks
+are dropped, and definitions that nothing reads any more are deleted.
+"""
+
+import json
+import sys
+
+import cfg
+import ssa
+
+# The lattice: a variable is TOP until something is known about it, a
+# Python int or bool while it has a single known value, and BOTTOM once
+# it can hold more than one.
+TOP = "top"
+BOTTOM = "bottom"
+
+INT_MASK = (1 << 64) - 1
+
+
+def wrap(value):
+    """Wrap an int to a signed 64-bit value, as Bril's ints do."""
+    value &= INT_MASK
+    return value - (1 << 64) if value >> 63 else value
+
+
+def divide(a, b):
+    if b == 0:
+        return BOTTOM  # Leave the trap to run time.
+    quotient = abs(a) // abs(b)
+    return wrap(quotient if (a < 0) == (b < 0) else -quotient)
+
+
+FOLD = {
+    "id": lambda a: a,
+    "add": lambda a, b: wrap(a + b),
+    "sub": lambda a, b: wrap(a - b),
+    "mul": lambda a, b: wrap(a * b),
+    "div": divide,
+    "eq": lambda a, b: a == b,
+    "lt": lambda a, b: a < b,
+    "gt": lambda a, b: a > b,
+    "le": lambda a, b: a <= b,
+    "ge": lambda a, b: a >= b,
+    "not": lambda a: not a,
+    "and": lambda a, b: a and b,
+    "or": lambda a, b: a or b,
+}
+
+# Operations with no effect besides their result, which can be deleted
+# once nothing reads it.
+PURE = set(FOLD) | {"const", "phi"}
+
+
+def meet(a, b):
+    if a == TOP:
+        return b
+    if b == TOP or a == b:
+        return a
+    return BOTTOM
+
+
+def propagate(blocks, params=()):
+    """Run the propagation over an SSA block map. Returns the lattice
+    value of every variable and the set of CFG edges, as (source,
+    target) name pairs, that can execute.
+    """
+    defined = set()
+    users = {}
+    for name, block in blocks.items():
+        for instr in block:
+            if "dest" in instr:
+                defined.add(instr["dest"])
+            for arg in instr.get("args", []):
+                users.setdefault(arg, []).append((name, instr))
+
+    values = {param: BOTTOM for param in params}
+    executable = set()
+    reached = set()
+
+    def value(arg):
+        # Variables with no definition at all (uses of undefined
+        # variables) could hold anything.
+        return values.get(arg, TOP if arg in defined else BOTTOM)
+
+    def evaluate(name, instr):
+        op = instr.get("op")
+        if op == "phi":
+            result = TOP
+            for arg, label in zip(instr["args"], instr["labels"]):
+                if (label, name) in executable and arg != ssa.UNDEFINED:
+                    result = meet(result, value(arg))
+            return result
+        if op == "const":
+            return instr["value"]
+        if op not in FOLD:
+            return BOTTOM
+        args = [value(arg) for arg in instr["args"]]
+        if BOTTOM in args:
+            return BOTTOM
+        if TOP in args:
+            return TOP
+        return FOLD[op](*args)
+
+    flow = [(None, next(iter(blocks)))]
+    uses = []
+
+    def visit(name, instr):
+        op = instr.get("op")
+        if op == "br":
+            cond = value(instr["args"][0])
+            if cond == BOTTOM:
+                targets = instr["labels"]
+            elif cond == TOP:
+                targets = []
+            else:
+                targets = [instr["labels"][0 if cond else 1]]
+            flow.extend((name, target) for target in targets)
+        elif op == "jmp":
+            flow.append((name, instr["labels"][0]))
+        elif "dest" in instr:
+            old = values.get(instr["dest"], TOP)
+            new = meet(old, evaluate(name, instr))
+            if new != old:
+                values[instr["dest"]] = new
+                uses.extend(users.get(instr["dest"], []))
+
+    while flow or uses:
+        if flow:
+            edge = flow.pop()
+            if edge in executable:
+                continue
+            executable.add(edge)
+            target = edge[1]
+            if target in reached:
+                # Only the phis can see the new edge.
+                for instr in blocks[target]:
+                    if instr.get("op") == "phi":
+                        visit(target, instr)
+            else:
+                reached.add(target)
+                for instr in blocks[target]:
+                    visit(target, instr)
+        else:
+            name, instr = uses.pop()
+            if name in reached:
+                visit(name, instr)
+
+    return values, executable
+
+
+def rewrite(blocks, values, executable):
+    """Apply the results of `propagate` to an SSA block map, in place."""
+    reached = {target for _, target in executable}
+    for name in list(blocks):
+        if name not in reached:
+            del blocks[name]
+
+    for name, block in blocks.items():
+        phis, body = [], []
+        for instr in block:
+            op = instr.get("op")
+            val = values.get(instr.get("dest"), BOTTOM)
+            if op in PURE and op != "const" and val not in (TOP, BOTTOM):
+                body.append({"op": "const", "dest": instr["dest"],
+                             "type": instr["type"], "value": val})
+            elif op == "phi":
+                live = [(arg, label) for arg, label in zip(instr["args"], instr["labels"])
+                        if (label, name) in executable]
+                instr["args"] = [arg for arg, _ in live]
+                instr["labels"] = [label for _, label in live]
+                phis.append(instr)
+            elif op == "br" and values.get(instr["args"][0], BOTTOM) not in (TOP, BOTTOM):
+                taken = instr["labels"][0 if values[instr["args"][0]] else 1]
+                body.append({"op": "jmp", "labels": [taken]})
+            else:
+                body.append(instr)
+        block[:] = phis + body
+
+
+def remove_dead(blocks):
+    """Delete pure definitions whose values never reach an effect, a
+    branch or a return, in place. This marks from the instructions that
+    have to stay, so cycles of dead phis and loop counters go too.
+    """
+    defs = {}
+    work = []
+    for block in blocks.values():
+        for instr in block:
+            if instr.get("op") in PURE:
+                defs[instr["dest"]] = instr
+            else:
+                work += instr.get("args", [])
+
+    needed = set()
+    while work:
+        var = work.pop()
+        if var not in needed:
+            needed.add(var)
+            if var in defs:
+                work += defs[var].get("args", [])
+
+    for block in blocks.values():
+        if any(instr.get("op") in PURE and instr["dest"] not in needed for instr in block):
+            block[:] = [instr for instr in block
+                        if instr.get("op") not in PURE or instr["dest"] in needed]
+
+
+def optimize(func):
+    """Return the instructions of a function after SCCP."""
+    blocks = optimize_blocks(func)
+    if not blocks:
+        return list(func["instrs"])
+    return cfg.reassemble(blocks, elide_jumps=True)
+
+
+def optimize_blocks(func, blocks=None):
+    """Run SCCP over a function and return its block map. The function's
+    `blocks`, if given, are changed in place (see `ssa.to_ssa`).
+    """
+    blocks, origins = ssa.to_ssa(func, blocks)
+    if not blocks:
+        return blocks
+    params = [arg["name"] for arg in func.get("args", [])]
+    values, executable = propagate(blocks, params)
+    rewrite(blocks, values, executable)
+    remove_dead(blocks)
+    # Nothing above moves code or propagates copies, so the function is
+    # still in conventional SSA and can go back to its original names.
+    ssa.from_ssa(blocks, origins)
+    return blocks
+
+
+if __name__ == "__main__":
+    prog = json.load(sys.stdin)
+    for func in prog["functions"]:
+        func["instrs"] = optimize(func)
+    print(json.dumps(prog, indent=2))
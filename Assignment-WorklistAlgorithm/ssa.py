@@ -0,0 +1,321 @@
+"""Static single assignment form for Bril functions.
+
+`to_ssa` builds the dominator tree of a function's CFG, places phi-nodes
+at the iterated dominance frontier of each variable's definitions and
+renames every definition to a fresh name. Only variables that are read
+in some block before that block writes them get phis (Briggs' semi-pruned
+form); the others never live across a block boundary. `from_ssa` turns
+the phis back into copies at the end of the predecessor blocks.
+
+Phis use the Bril SSA syntax `x.2: int = phi x.0 x.1 .left .right;`,
+where `args[i]` is the value coming in from the block `labels[i]`. An
+argument that has no definition on its edge is `__undefined`.
+"""
+
+import json
+import sys
+
+import cfg
+from form_blocks import form_blocks
+from util import fresh
+
+UNDEFINED = "__undefined"
+
+
+def prepare(instrs):
+    """Form the block map of a function the way SSA construction wants
+    it: an entry block without predecessors, a terminator at the end of
+    every block and no blocks that the entry cannot reach.
+    """
+    blocks = cfg.block_map(form_blocks(instrs))
+    if blocks:
+        normalize(blocks)
+    return blocks
+
+
+def normalize(blocks):
+    """Bring a non-empty block map into the shape `prepare` gives, in
+    place.
+    """
+    cfg.add_entry(blocks)
+    cfg.add_terminators(blocks)
+    graph = cfg.flow_graph(blocks)
+    reachable = set(cfg.reverse_postorder(graph))
+    for i, name in enumerate(graph.names):
+        if i not in reachable:
+            del blocks[name]
+
+
+def dominator_tree(blocks):
+    """Return the immediate dominator of every block (the entry maps to
+    itself) and the children of every block in the dominator tree. All
+    blocks have to be reachable from the entry.
+    """
+    graph = cfg.flow_graph(blocks)
+    order = cfg.reverse_postorder(graph)
+    idom_ids = cfg.immediate_dominator_ids(graph, 0, order)
+    idom = {graph.names[node]: graph.names[idom_ids[node]] for node in order}
+    children = {name: [] for name in blocks}
+    for node in order[1:]:
+        children[graph.names[idom_ids[node]]].append(graph.names[node])
+    return idom, children
+
+
+def dominance_frontiers(blocks, idom):
+    """The dominance frontier of every block: the blocks it does not
+    strictly dominate but that have a predecessor it dominates.
+    """
+    preds, _ = cfg.edges(blocks)
+    frontiers = {name: set() for name in blocks}
+    for name in blocks:
+        if len(preds[name]) < 2:
+            continue
+        for pred in preds[name]:
+            runner = pred
+            while runner != idom[name]:
+                frontiers[runner].add(name)
+                runner = idom[runner]
+    return frontiers
+
+
+def variable_types(func):
+    """The type of every variable a function defines or takes."""
+    types = {arg["name"]: arg["type"] for arg in func.get("args", [])}
+    for instr in func["instrs"]:
+        if "dest" in instr:
+            types[instr["dest"]] = instr["type"]
+    return types
+
+
+def insert_phis(blocks, frontiers, types, params=()):
+    """Create the phis of every block, as a dict from each block name to
+    a dict from original variable name to phi instruction. The phis have
+    no arguments yet; renaming fills them in.
+    """
+    entry = next(iter(blocks))
+    defsites = {param: {entry} for param in params}
+    crossing = set()
+    for name, block in blocks.items():
+        written = set()
+        for instr in block:
+            for arg in instr.get("args", []):
+                if arg not in written:
+                    crossing.add(arg)
+            if "dest" in instr:
+                written.add(instr["dest"])
+                defsites.setdefault(instr["dest"], set()).add(name)
+
+    phis = {name: {} for name in blocks}
+    for var in sorted(crossing & defsites.keys()):
+        work = list(defsites[var])
+        queued = set(work)
+        while work:
+            for join in frontiers[work.pop()]:
+                if var not in phis[join]:
+                    phis[join][var] = {"op": "phi", "dest": var, "type": types[var],
+                                       "args": [], "labels": []}
+                    if join not in queued:
+                        queued.add(join)
+                        work.append(join)
+    return phis
+
+
+def rename(blocks, phis, children, params=()):
+    """Give every definition a fresh name and point every use at the
+    definition that reaches it, walking the dominator tree with a stack
+    of current names per variable. Variables that are read but never
+    defined (including parameters that are never reassigned) keep their
+    names. Returns a dict from each new name to the variable it
+    replaces.
+    """
+    taken = set(params)
+    for name, block in blocks.items():
+        for instr in block:
+            taken.update(instr.get("args", []))
+            if "dest" in instr:
+                taken.add(instr["dest"])
+    counters = {}
+
+    def new_name(var):
+        i = counters.get(var, 0)
+        while "{}.{}".format(var, i) in taken:
+            i += 1
+        counters[var] = i + 1
+        name = "{}.{}".format(var, i)
+        taken.add(name)
+        return name
+
+    stacks = {param: [param] for param in params}
+    origins = {}
+
+    def define(var, pushed):
+        name = new_name(var)
+        origins[name] = var
+        stacks.setdefault(var, []).append(name)
+        pushed.append(var)
+        return name
+
+    entry = next(iter(blocks))
+    work = [entry]
+    while work:
+        item = work.pop()
+        if isinstance(item, list):  # Leaving a block: pop its names.
+            for var in item:
+                stacks[var].pop()
+            continue
+        pushed = []
+        for var, phi in phis[item].items():
+            phi["dest"] = define(var, pushed)
+        for instr in blocks[item]:
+            if "args" in instr:
+                instr["args"] = [stacks[arg][-1] if stacks.get(arg) else arg
+                                 for arg in instr["args"]]
+            if "dest" in instr:
+                instr["dest"] = define(instr["dest"], pushed)
+        for succ in dict.fromkeys(cfg.successors(blocks[item][-1])):
+            for var, phi in phis[succ].items():
+                phi["args"].append(stacks[var][-1] if stacks.get(var) else UNDEFINED)
+                phi["labels"].append(item)
+        work.append(pushed)
+        work += reversed(children[item])
+    return origins
+
+
+def to_ssa(func, blocks=None):
+    """Return the block map of a function in SSA form, and the dict from
+    each new variable name to the original it renames. The function's
+    own instructions are left alone.
+
+    If the function's `blocks` are given, they are converted in place
+    instead of being formed from its instructions. Each instruction is
+    copied first, so the originals are left alone here too.
+    """
+    if blocks is None:
+        blocks = prepare([dict(instr) for instr in func["instrs"]])
+    elif blocks:
+        for block in blocks.values():
+            block[:] = [dict(instr) for instr in block]
+        normalize(blocks)
+    if not blocks:
+        return blocks, {}
+    params = [arg["name"] for arg in func.get("args", [])]
+    idom, children = dominator_tree(blocks)
+    frontiers = dominance_frontiers(blocks, idom)
+    phis = insert_phis(blocks, frontiers, variable_types(func), params)
+    origins = rename(blocks, phis, children, params)
+    for name, block in blocks.items():
+        block[0:0] = phis[name].values()
+    return blocks, origins
+
+
+def remove_dead_phis(blocks):
+    """Delete the phis whose results are never read, in place. A phi
+    that only other dead phis read is dead too.
+    """
+    phis = {}
+    used = []
+    for block in blocks.values():
+        for instr in block:
+            if instr.get("op") == "phi":
+                phis[instr["dest"]] = instr
+            else:
+                used += instr.get("args", [])
+    live = set()
+    while used:
+        var = used.pop()
+        if var in phis and var not in live:
+            live.add(var)
+            used += phis[var]["args"]
+    for block in blocks.values():
+        block[:] = [instr for instr in block
+                    if instr.get("op") != "phi" or instr["dest"] in live]
+
+
+def from_ssa(blocks, origins=None):
+    """Replace the phis of an SSA block map with copies, in place.
+
+    The copies for an edge go at the end of its source block, or into a
+    new block on the edge when the source has other successors (a
+    critical edge). When one phi of a block reads the result of another,
+    the copies go through temporaries so they act all at once. Phis
+    whose results are never read are dropped first: semi-pruned form
+    places them for variables that are dead at the join, and copying
+    them would read versions that were never assigned.
+
+    Passing the `origins` from `to_ssa` says that the code is still in
+    conventional SSA form: no two versions of a variable are live at the
+    same time, which holds as long as no pass has moved code or
+    propagated copies. Then every version just gets its original name
+    back and the phis are dropped, with no copies at all.
+    """
+    if origins is not None:
+        for block in blocks.values():
+            block[:] = [instr for instr in block if instr.get("op") != "phi"]
+            for instr in block:
+                if "args" in instr:
+                    instr["args"] = [origins.get(arg, arg) for arg in instr["args"]]
+                if "dest" in instr:
+                    instr["dest"] = origins.get(instr["dest"], instr["dest"])
+        return blocks
+
+    taken = set()
+    for block in blocks.values():
+        for instr in block:
+            taken.update(instr.get("args", []))
+            if "dest" in instr:
+                taken.add(instr["dest"])
+
+    remove_dead_phis(blocks)
+    for name in list(blocks):
+        block = blocks[name]
+        phis = [instr for instr in block if instr.get("op") == "phi"]
+        if not phis:
+            continue
+        block[:] = [instr for instr in block if instr.get("op") != "phi"]
+
+        incoming = {}
+        for phi in phis:
+            for arg, label in zip(phi["args"], phi["labels"]):
+                if arg != UNDEFINED and arg != phi["dest"]:
+                    incoming.setdefault(label, []).append((phi["dest"], phi["type"], arg))
+
+        for pred, moves in incoming.items():
+            term = blocks[pred][-1]
+            if len(set(cfg.successors(term))) > 1:
+                split = fresh("{}.to.{}.".format(pred, name), blocks)
+                term["labels"] = [split if label == name else label for label in term["labels"]]
+                blocks[split] = cfg.Block([{"op": "jmp", "labels": [name]}])
+                pred = split
+            copies = []
+            dests = {dest for dest, _, _ in moves}
+            if any(arg in dests for _, _, arg in moves):
+                temps = []
+                for dest, typ, arg in moves:
+                    temp = fresh(dest + ".tmp", taken)
+                    taken.add(temp)
+                    copies.append({"op": "id", "dest": temp, "type": typ, "args": [arg]})
+                    temps.append(temp)
+                moves = [(dest, typ, temp) for (dest, typ, _), temp in zip(moves, temps)]
+            copies += [{"op": "id", "dest": dest, "type": typ, "args": [arg]}
+                       for dest, typ, arg in moves]
+            blocks[pred][-1:-1] = copies
+    return blocks
+
+
+def ssa():
+    """Print the program read from stdin in SSA form, or with
+    `--roundtrip` converted into SSA and back out again.
+    """
+    roundtrip = "--roundtrip" in sys.argv[1:]
+    prog = json.load(sys.stdin)
+    for func in prog["functions"]:
+        blocks, _ = to_ssa(func)
+        if roundtrip:
+            from_ssa(blocks)
+        func["instrs"] = cfg.reassemble(blocks, elide_jumps=True)
+    json.dump(prog, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    ssa()
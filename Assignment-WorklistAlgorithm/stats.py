@@ -0,0 +1,53 @@
+"""Counters and timers for one run of the data flow solver.
+
+Pass a `WorklistStats` to `df.df_worklist` to find out where a slow
+analysis spends its time: how often the worklist is used, how many
+merges and transfers run and how long they take, and how often each
+block's output changes (a block that changes many times sits on a cycle
+that takes long to settle).
+"""
+
+import json
+
+
+class WorklistStats:
+    """What the solver did for one function."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.pushes = 0
+        self.pops = 0
+        self.merges = 0
+        self.transfers = 0
+        self.merge_seconds = 0.0
+        self.transfer_seconds = 0.0
+        self.changed = {}
+
+    def as_dict(self):
+        return {
+            "function": self.name,
+            "pushes": self.pushes,
+            "pops": self.pops,
+            "merges": self.merges,
+            "merge_seconds": self.merge_seconds,
+            "transfers": self.transfers,
+            "transfer_seconds": self.transfer_seconds,
+            "changed": self.changed,
+        }
+
+    def to_json(self):
+        """The stats as a single line of JSON."""
+        return json.dumps(self.as_dict())
+
+    def format(self):
+        """The stats as a short human-readable report."""
+        lines = [
+            "{}:".format(self.name),
+            "  worklist:  {} pushes, {} pops".format(self.pushes, self.pops),
+            "  merge:     {} calls, {:.6f}s".format(self.merges, self.merge_seconds),
+            "  transfer:  {} calls, {:.6f}s".format(self.transfers, self.transfer_seconds),
+            "  changed:   {} outputs".format(sum(self.changed.values())),
+        ]
+        for node, count in self.changed.items():
+            lines.append("    {}: {}".format(node, count))
+        return "".join(line + "\n" for line in lines)
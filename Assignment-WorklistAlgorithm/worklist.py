@@ -0,0 +1,191 @@
+"""Worklist schedulers for the data flow solver in df.py.
+
+A scheduler decides which pending block the solver visits next. Each
+one is built from the block map and the CFG edges of a function and
+supports `push(node)`, `pop()` and truth testing (is anything left).
+It starts out holding the `seeds` blocks, or every block if `seeds` is
+None.
+"""
+
+import heapq
+from collections import deque
+
+
+def postorder_from(root, succs, visited):
+    """Depth-first postorder of the blocks reachable from `root` that
+    are not in `visited` yet. Uses an explicit stack, so long chains
+    of blocks do not hit the recursion limit.
+    """
+    postorder = []
+    visited.add(root)
+    stack = [(root, iter(succs[root]))]
+    while stack:
+        node, it = stack[-1]
+        for succ in it:
+            if succ not in visited:
+                visited.add(succ)
+                stack.append((succ, iter(succs[succ])))
+                break
+        else:
+            stack.pop()
+            postorder.append(node)
+    return postorder
+
+
+def depth_first_order(blocks, succs):
+    """Return the blocks in reverse postorder of a depth-first search
+    from the entry block. Blocks that cannot be reached from the entry
+    follow, in block-map order.
+    """
+    visited = set()
+    order = []
+    for root in blocks:
+        if root not in visited:
+            order += reversed(postorder_from(root, succs, visited))
+    return order
+
+
+def strongly_connected_components(blocks, succs):
+    """Tarjan's algorithm: return the strongly connected components of
+    the CFG as lists of block names, each component after all the
+    components it has edges into (so the exit comes first). Iterative,
+    like `postorder_from`.
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in blocks:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(succs[root]))]
+        while work:
+            node, it = work[-1]
+            for succ in it:
+                if succ not in index:
+                    index[succ] = low[succ] = len(index)
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(succs[succ])))
+                    break
+                if succ in on_stack:
+                    low[node] = min(low[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+class FifoWorklist:
+    """The original scheduler: a first-in first-out queue seeded in
+    block-map order, where a block can be queued any number of times.
+    """
+
+    def __init__(self, blocks, succs, forward, seeds=None):
+        self.queue = deque(blocks.keys() if seeds is None else seeds)
+
+    def __bool__(self):
+        return bool(self.queue)
+
+    def push(self, node):
+        self.queue.append(node)
+
+    def pop(self):
+        return self.queue.popleft()
+
+
+class OrderedWorklist:
+    """Visit pending blocks in passes over reverse postorder (postorder
+    for backward analyses). A block pushed ahead of the current position
+    is visited later in the same pass; a block pushed behind it (the
+    target of a back edge) waits for the next pass, so the changes of a
+    whole pass are propagated together. A block is pending at most once,
+    so the worklist never grows past the number of blocks.
+    """
+
+    def __init__(self, blocks, succs, forward, seeds=None):
+        order = depth_first_order(blocks, succs)
+        if not forward:
+            order.reverse()
+        self.rank = {node: i for i, node in enumerate(order)}
+        if seeds is None:
+            self.current = [(i, node) for i, node in enumerate(order)]
+        else:
+            self.current = sorted((self.rank[node], node) for node in seeds)
+        self.next = []
+        self.pending = {node for _, node in self.current}
+        self.position = -1
+
+    def __bool__(self):
+        return bool(self.current or self.next)
+
+    def push(self, node):
+        if node not in self.pending:
+            self.pending.add(node)
+            rank = self.rank[node]
+            heapq.heappush(self.current if rank > self.position else self.next, (rank, node))
+
+    def pop(self):
+        if not self.current:
+            self.current, self.next = self.next, self.current
+        self.position, node = heapq.heappop(self.current)
+        self.pending.discard(node)
+        return node
+
+
+class ComponentWorklist(OrderedWorklist):
+    """Solve one strongly connected component of the CFG at a time, in
+    topological order of the condensed graph (reverse topological order
+    for backward analyses). Inside a component, blocks are visited in
+    passes over reverse postorder like `OrderedWorklist`, and the
+    component is iterated to its fixed point before any block of a later
+    component runs. A block after a loop is then evaluated once, with
+    the loop's final values, instead of every time they change.
+    """
+
+    def __init__(self, blocks, succs, forward, seeds=None):
+        components = strongly_connected_components(blocks, succs)
+        if forward:
+            components.reverse()
+        component = {node: i for i, members in enumerate(components) for node in members}
+        order = depth_first_order(blocks, succs)
+        if not forward:
+            order.reverse()
+        self.rank = {node: (component[node], i) for i, node in enumerate(order)}
+        if seeds is None:
+            seeds = order
+        self.current = sorted((self.rank[node], node) for node in seeds)
+        self.next = []
+        self.pending = {node for _, node in self.current}
+        self.position = (-1, -1)
+
+    def pop(self):
+        # Blocks wait in `next` only for another pass over the current
+        # component, and that pass comes before any later component.
+        if self.next and (not self.current or self.current[0][0][0] != self.position[0]):
+            self.current += self.next
+            heapq.heapify(self.current)
+            self.next = []
+        return super().pop()
+
+
+SCHEDULERS = {
+    "fifo": FifoWorklist,
+    "rpo": OrderedWorklist,
+    "scc": ComponentWorklist,
+}
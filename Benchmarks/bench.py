@@ -0,0 +1,353 @@
+"""Scaling benchmarks for the CFG, data flow and optimization tools.
+
+Generates Bril programs of a given number of blocks with a few
+characteristic shapes, runs every mycfg.py mode, every df.py analysis
+and the optimization passes on each one, and records the best wall-clock
+time and the peak memory (as seen by tracemalloc) of each run. For the
+data flow analyses it also counts the transfer function calls the
+worklist solver makes.
+
+Results are compared against a stored baseline. Wall-clock times
+depend on the machine, so they are stored relative to a reference tool
+(`mycfg -c`) timed on the same program in the same run. A run whose
+relative time or peak memory exceeds the baseline by more than the
+tolerance, or whose transfer count grows at all, counts as a regression
+and makes the script exit with status 1.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for folder in ("Assignment-WorklistAlgorithm", "Assignment-WorkingWithCFGs", "Exercises"):
+    sys.path.insert(0, os.path.join(ROOT, folder))
+
+import df
+import mycfg
+import sccp
+import tdce
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+# PROGRAM GENERATORS
+#
+# Each one takes a number of blocks and returns a `main` function with
+# roughly that many. They only use core Bril, and every program ends.
+
+def _op(op, dest, typ, *args):
+    return {"op": op, "dest": dest, "type": typ, "args": list(args)}
+
+
+def _const(dest, value, typ="int"):
+    return {"op": "const", "dest": dest, "type": typ, "value": value}
+
+
+def _jmp(label):
+    return {"op": "jmp", "labels": [label]}
+
+
+def _br(cond, then, other):
+    return {"op": "br", "args": [cond], "labels": [then, other]}
+
+
+def _main(instrs):
+    return {"name": "main", "args": [{"name": "n", "type": "int"}], "instrs": instrs}
+
+
+def chain(size):
+    """A straight line of blocks, each jumping to the next."""
+    instrs = [_const("x", 0), _const("one", 1)]
+    for i in range(size):
+        instrs += [{"label": "b{}".format(i)}, _op("add", "x", "int", "x", "one"),
+                   _jmp("b{}".format(i + 1))]
+    instrs += [{"label": "b{}".format(size)}, {"op": "print", "args": ["x"]}]
+    return _main(instrs)
+
+
+def nested_loops(size):
+    """Loops nested inside each other, four blocks per level, with a
+    separate counter per level.
+    """
+    depth = max(1, size // 4)
+    instrs = [_const("acc", 0), _const("one", 1), _const("i0", 0)]
+    for k in range(depth):
+        counter = "i{}".format(k)
+        instrs += [{"label": "h{}".format(k)}, _op("lt", "c{}".format(k), "bool", counter, "n"),
+                   _br("c{}".format(k), "b{}".format(k), "x{}".format(k)),
+                   {"label": "b{}".format(k)}]
+        if k + 1 < depth:
+            instrs += [_const("i{}".format(k + 1), 0), _jmp("h{}".format(k + 1))]
+        else:
+            instrs += [_op("add", "acc", "int", "acc", counter), _jmp("l{}".format(k))]
+    for k in reversed(range(depth)):
+        instrs += [{"label": "x{}".format(k)}]
+        instrs += [_jmp("l{}".format(k - 1))] if k else [{"op": "print", "args": ["acc"]},
+                                                           {"op": "ret"}]
+        instrs += [{"label": "l{}".format(k)}, _op("add", "i{}".format(k), "int", "i{}".format(k), "one"),
+                   _jmp("h{}".format(k))]
+    return _main(instrs)
+
+
+def switch_fan(size):
+    """A switch written as a chain of `br`s, two blocks per case, where
+    every case joins the same block at the end.
+    """
+    cases = max(1, size // 2)
+    instrs = [_const("acc", 0)]
+    for k in range(cases):
+        instrs += [{"label": "case{}".format(k)}, _const("k", k), _op("eq", "c", "bool", "n", "k"),
+                   _br("c", "arm{}".format(k), "case{}".format(k + 1)),
+                   {"label": "arm{}".format(k)}, _op("add", "acc", "int", "acc", "k"), _jmp("join")]
+    instrs += [{"label": "case{}".format(cases)}, {"label": "join"},
+               {"op": "print", "args": ["acc"]}]
+    return _main(instrs)
+
+
+def figure8_mesh(size):
+    """A row of irreducible figure-8 loops: each one is a pair of blocks
+    that branch to each other and are both entered from outside.
+    """
+    loops = max(1, size // 3)
+    instrs = [_const("x", 0), _const("one", 1)]
+    for k in range(loops):
+        a, b, out = "a{}".format(k), "b{}".format(k), "e{}".format(k + 1)
+        instrs += [{"label": "e{}".format(k)}, _op("lt", "c", "bool", "x", "n"), _br("c", a, b)]
+        for here, there in ((a, b), (b, a)):
+            instrs += [{"label": here}, _op("add", "x", "int", "x", "one"),
+                       _op("lt", "c", "bool", "x", "n"), _br("c", there, out)]
+    instrs += [{"label": "e{}".format(loops)}, {"op": "print", "args": ["x"]}]
+    return _main(instrs)
+
+
+def many_vars(size):
+    """One loop over a body of `size` blocks, where every block defines
+    its own variable from two others, so the data flow sets hold about
+    `size` facts each.
+    """
+    instrs = [_const("one", 1), _const("i", 0)]
+    instrs += [_const("v{}".format(k), k) for k in range(size)]
+    instrs += [{"label": "head"}, _op("lt", "c", "bool", "i", "n"), _br("c", "v0", "done")]
+    for k in range(size):
+        dest = "v{}".format(k)
+        instrs += [{"label": dest},
+                   _op("add", dest, "int", "v{}".format((k * 7 + 1) % size), "v{}".format((k + 3) % size))]
+    instrs += [_op("add", "i", "int", "i", "one"), _jmp("head"),
+               {"label": "done"}, {"op": "print", "args": ["v0"]}]
+    return _main(instrs)
+
+
+PROGRAMS = {
+    "chain": chain,
+    "loops": nested_loops,
+    "switch": switch_fan,
+    "figure8": figure8_mesh,
+    "vars": many_vars,
+}
+
+
+# TOOLS
+#
+# Each one takes a function and does what the command line tool does
+# for it, minus reading and printing JSON.
+
+def _quiet(run):
+    def wrapper(func):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+            return run(func)
+    return wrapper
+
+
+TOOLS = {}
+for _mode in ("-c", "-l", "-L", "-p", "-b", "-r"):
+    TOOLS["mycfg " + _mode] = lambda func, mode=_mode: mycfg.cfg_report(func, mode)
+for _name in ("defined", "live", "cprop", "reaching", "available"):
+    TOOLS["df " + _name] = lambda func, name=_name: df.df_function(func, name)
+for _name in ("reaching", "available"):
+    TOOLS["df {} --dense".format(_name)] = lambda func, name=_name: df.df_function(func, name, dense=True)
+TOOLS["tdce"] = _quiet(lambda func: tdce.eliminate(func["instrs"]))
+TOOLS["sccp"] = sccp.optimize
+
+# The tool every time is divided by.
+REFERENCE = "mycfg -c"
+
+
+def _transfers(name, dense=False):
+    """Count the transfer function calls of a df.py analysis, from the
+    stats it prints.
+    """
+    def count(func):
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            df.df_function(func, name, dense=dense, stats="json")
+        return json.loads(err.getvalue())["transfers"]
+    return count
+
+
+# Tools whose work can be counted, which unlike the time does not
+# depend on the machine.
+COUNTERS = {}
+for _name in ("defined", "live", "cprop", "reaching", "available"):
+    COUNTERS["df " + _name] = _transfers(_name)
+for _name in ("reaching", "available"):
+    COUNTERS["df {} --dense".format(_name)] = _transfers(_name, dense=True)
+
+
+def best_time(tool, text, repeat):
+    """Best time over `repeat` runs. Every run gets its own copy of the
+    function, decoded from `text`.
+    """
+    best = None
+    for _ in range(repeat):
+        func = json.loads(text)
+        # Like timeit, keep garbage collections out of the timed runs.
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            tool(func)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(tool, text, repeat):
+    """Best time over `repeat` runs, then peak memory over one more run
+    (tracemalloc slows the program down, so it is not timed).
+    """
+    best = best_time(tool, text, repeat)
+    func = json.loads(text)
+    tracemalloc.start()
+    try:
+        tool(func)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def regressions(result, base, reference, tolerance):
+    """The ways `result` is worse than `base`, where `reference` is the
+    time of REFERENCE in this run. Small absolute differences in time
+    and memory (5 ms, 64 KiB) are noise and never count.
+    """
+    found = []
+    if "relative" in base:
+        expected = base["relative"] * reference
+        if result["seconds"] > expected * (1 + tolerance) + 0.005:
+            found.append("time {:.1f}x vs {:.1f}x {}".format(
+                result["relative"], base["relative"], REFERENCE))
+    if result["peak_kib"] > base["peak_kib"] * (1 + tolerance) + 64:
+        found.append("memory {} KiB vs {} KiB".format(result["peak_kib"], base["peak_kib"]))
+    # The count does not depend on the machine, so any growth is real.
+    if "transfers" in base and result.get("transfers", 0) > base["transfers"]:
+        found.append("transfers {} vs {}".format(result["transfers"], base["transfers"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the CFG and data flow tools on generated Bril programs.")
+    parser.add_argument("--programs", nargs="+", choices=sorted(PROGRAMS), default=list(PROGRAMS),
+                        help="program shapes to generate (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000], metavar="N",
+                        help="numbers of blocks, e.g. 10 100 1000 10000 100000 1000000 (default: 10 100 1000)")
+    parser.add_argument("--tools", nargs="+", metavar="TOOL",
+                        help="only run the tools whose names contain one of these strings")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per measurement; the best one counts (default: 3)")
+    parser.add_argument("--limit", type=float, default=10.0, metavar="SECONDS",
+                        help="skip the larger sizes of a tool on a program once one size takes longer than this (default: 10)")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="baseline file to compare against (default: baseline.json next to this script)")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown or growth over the baseline, as a fraction (default: 0.5)")
+    parser.add_argument("--save", action="store_true",
+                        help="write the results into the baseline file instead of comparing")
+    parser.add_argument("--emit", nargs=2, metavar=("PROGRAM", "SIZE"),
+                        help="print one generated program as Bril JSON and exit")
+    args = parser.parse_args()
+
+    if args.emit:
+        program, size = args.emit
+        print(json.dumps({"functions": [PROGRAMS[program](int(size))]}, indent=2))
+        return
+
+    tools = [name for name in TOOLS
+             if not args.tools or any(pattern in name for pattern in args.tools)]
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    failures = []
+    print("{:<8} {:>8}  {:<24} {:>10} {:>9} {:>10} {:>10}".format(
+        "program", "blocks", "tool", "seconds", "relative", "peak KiB", "transfers"))
+    for program in args.programs:
+        too_slow = set()
+        for size in sorted(args.sizes):
+            text = json.dumps(PROGRAMS[program](size))
+            # Every ratio depends on it, so it gets more runs than the
+            # others, both before and after them.
+            reference = best_time(TOOLS[REFERENCE], text, max(args.repeat, 10))
+            measured = []
+            for tool in tools:
+                if tool in too_slow:
+                    continue
+                seconds, peak = measure(TOOLS[tool], text, args.repeat)
+                measured.append((tool, seconds, peak))
+                if seconds > args.limit:
+                    too_slow.add(tool)
+            reference = min(reference, best_time(TOOLS[REFERENCE], text, max(args.repeat, 10)))
+
+            for tool, seconds, peak in measured:
+                key = "{}/{}/{}".format(program, size, tool)
+                result = results[key] = {"seconds": round(seconds, 6),
+                                         "relative": round(seconds / reference, 3),
+                                         "peak_kib": peak // 1024}
+                if tool in COUNTERS:
+                    result["transfers"] = COUNTERS[tool](json.loads(text))
+                found = []
+                if not args.save and key in baseline:
+                    found = regressions(result, baseline[key], reference, args.tolerance)
+                    if found and found[0].startswith("time"):
+                        # Timing noise comes in bursts, so a slow run has
+                        # to be slow a second time to count.
+                        retry = best_time(TOOLS[tool], text, args.repeat)
+                        if retry < seconds:
+                            result["seconds"] = round(retry, 6)
+                            result["relative"] = round(retry / reference, 3)
+                            found = regressions(result, baseline[key], reference, args.tolerance)
+                line = "{:<8} {:>8}  {:<24} {:>10.4f} {:>9.1f} {:>10} {:>10}".format(
+                    program, size, tool, result["seconds"], result["relative"], result["peak_kib"],
+                    result.get("transfers", ""))
+                if found:
+                    failures.append((key, found))
+                    line += "  REGRESSION: " + ", ".join(found)
+                print(line, flush=True)
+
+    if args.save:
+        # Absolute times only mean something on this machine.
+        for result in results.values():
+            del result["seconds"]
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("saved {} results to {}".format(len(results), args.baseline))
+        return
+    if failures:
+        print("{} regression(s) against {}".format(len(failures), args.baseline), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
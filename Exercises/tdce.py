@@ -7,35 +7,149 @@ September 10, 2025
 Exercise: Simple Dead Code Elimination
 """
 import json
+import os
 import sys
+import argparse
 
+# shared Bril helpers (streaming reader, ...) live with the worklist assignment
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Assignment-WorklistAlgorithm'))
+import jsonstream
+import brilbin
+from form_blocks import form_blocks
+import cfg
+import df
+
+# operations that must stay even when their result is never read
+SIDE_EFFECTS = 'call', 'print', 'store', 'free', 'alloc'
+
+# an instruction can be deleted when it only computes its dest
+def removable(instr):
+    return 'dest' in instr and instr.get('op') not in SIDE_EFFECTS
+
+# Sweep every block backwards from its live-out set and return the
+# (still present) removable instructions whose dest is dead right after them
+def dead_by_liveness(blocks, live_out, deleted):
+    dead = []
+    for name, block in blocks.items():
+        live = set(live_out[name])
+        for instr in reversed(block):
+            if id(instr) in deleted:
+                continue
+            if removable(instr) and instr['dest'] not in live:
+                dead.append(instr)
+                continue
+            live.discard(instr.get('dest'))
+            live.update(instr.get('args', []))
+    return dead
+
+# Global dead code elimination. Liveness (the `live` analysis in df.py)
+# finds the definitions that are dead where they are. After that, an index
+# of how many remaining instructions read each variable drives a worklist:
+# deleting an instruction lowers the counts of its args, and only the
+# definitions of variables that drop to zero uses are queued. Liveness is
+# solved again only if a deletion removed a read of a variable that is
+# still read elsewhere (the one case the counts can't settle), and then
+# incrementally, from the blocks that changed, so the pass reaches a fixed
+# point without rescanning the function per deletion.
 def eliminate(instructions):
-    used = set()
+    blocks = cfg.block_map(form_blocks(instructions))
+    if not blocks:
+        return list(instructions)
+    cfg.add_terminators(blocks)
+    deleted = eliminate_blocks(blocks)
+    return [instr for instr in instructions if id(instr) not in deleted]
+
+# The same on a block map whose blocks end in terminators (as
+# df.function_blocks makes it). The blocks are edited in place, and the
+# ids of the deleted instructions are returned
+def eliminate_blocks(blocks):
+    deleted = set() # ids of the deleted instructions
+    uses = {}       # variable -> number of remaining instructions reading it
+    defs = {}       # variable -> removable instructions writing it
+    owner = {}      # id of a removable instruction -> name of its block
+    for name, block in blocks.items():
+        for instr in block:
+            for arg in instr.get('args', []):
+                uses[arg] = uses.get(arg, 0) + 1
+            if removable(instr):
+                defs.setdefault(instr['dest'], []).append(instr)
+                owner[id(instr)] = name
+    
+    changed_blocks = set()
     
-    # Collect all used instructions
-    for instr in instructions:
+    def delete(instr, worklist, touched):
+        deleted.add(id(instr))
+        changed_blocks.add(owner[id(instr)])
+        print("Instruction deleted: ", instr, file=sys.stderr)
         for arg in instr.get('args', []):
-            used.add(arg)
-            
-    # Remove dead code
-    optimized_instrs = []
-    for instr in instructions:
-        dest = instr.get('dest')
-        if dest and dest not in used:
-            print("Instruction deleted: ", instr, file=sys.stderr)
-        else:
-            optimized_instrs.append(instr)
+            uses[arg] -= 1
+            touched.add(arg)
+            if uses[arg] == 0:
+                worklist.append(arg)
     
-    return optimized_instrs
+    worklist = [var for var in defs if uses.get(var, 0) == 0]
+    live = df.ANALYSES['live']
+    solution = df.df_worklist(blocks, live)
+    resolve = True
+    while resolve:
+        touched = set() # variables that lost a read this round
+        _, live_out = solution
+        for instr in dead_by_liveness(blocks, live_out, deleted):
+            delete(instr, worklist, touched)
+        
+        while worklist:
+            var = worklist.pop()
+            for instr in defs.get(var, []):
+                if id(instr) not in deleted:
+                    delete(instr, worklist, touched)
+        
+        # drop the deleted instructions from the blocks (which also
+        # invalidates their cached liveness summaries)
+        for name in changed_blocks:
+            blocks[name][:] = [instr for instr in blocks[name] if id(instr) not in deleted]
+        
+        # a read that went away may have made an earlier definition dead
+        # even though its variable is still read somewhere else
+        resolve = any(uses[var] > 0 for var in touched)
+        if resolve:
+            solution = df.df_incremental(blocks, live, solution, changed_blocks)
+        changed_blocks.clear()
+    
+    return deleted
             
         
 
 def my_dce():
-    program = json.load(sys.stdin)
+    parser = argparse.ArgumentParser(description="Global dead code elimination for a Bril program read from stdin.")
+    parser.add_argument("--stream", action="store_true",
+                        help="read, optimize and write one function at a time")
+    parser.add_argument("--binary", action="store_true",
+                        help="write the program in the binary format of brilbin.py instead of JSON")
+    args = parser.parse_args()
+    
+    if args.stream:
+        # Only one function is in memory at a time, and each one is
+        # written out as soon as it is optimized.
+        extras = {}
+        if args.binary:
+            writer = brilbin.BinaryWriter(sys.stdout.buffer)
+        else:
+            writer = jsonstream.ProgramWriter(sys.stdout)
+        for function in brilbin.iter_functions(sys.stdin, extras):
+            function['instrs'] = eliminate(function['instrs'])
+            writer.write_function(function)
+            sys.stdout.flush()
+        writer.close(extras)
+        return
+    
+    program = brilbin.load_program(sys.stdin)
     for function in program['functions']:
         function['instrs'] = eliminate(function['instrs'])
     
-    print(json.dumps(program, indent=2))
+    if args.binary:
+        brilbin.dump(program, sys.stdout.buffer)
+    else:
+        print(json.dumps(program, indent=2))
 
     
 